@@ -0,0 +1,451 @@
+"""Offline benchmarks for CrewCaptain hot paths.
+
+Run everything with `python benchmarks.py` or a single benchmark with
+`python benchmarks.py intent`.
+"""
+import gc
+import json
+import marshal
+import os
+import pickle
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace as NS
+
+from decision_bot import (CrewCaptain, ActiveMember, AliasTable, ChatSchedule, ChoiceList, SCHEDULE_TIMES, decode_snapshot,
+                          edit_distance, encode_snapshot, next_run, phrase_pattern, tokenize, typo_budget)
+
+# Hand-labelled chat lines: (message, expected passive category or None)
+INTENT_EVAL = [
+ ("hey bot, you there?", "summoning"), ("yo captain help us out", "summoning"), ("can the bot help", "summoning"),
+ ("I really can't decide", "decision_making"), ("you guys decide, I don't care", "decision_making"), ("I'm so indecisive tonight", "decision_making"), ("any suggestions?", "decision_making"), ("someone just choose already", "decision_making"),
+ ("ok who's paying tonight", "payment"), ("who pays for this round?", "payment"), ("let's split the bill", "payment"), ("I paid last time!", "payment"), ("whose turn is it to pay", "payment"), ("who's buying drinks", "payment"),
+ ("let's vote on it", "voting"), ("poll time people", "voting"), ("majority rules ok", "voting"), ("let's do a group vote", "voting"),
+ ("where should we eat tonight", "food_location"), ("I'm hungry", "food_location"), ("so hungry rn", "food_location"), ("any dinner plans?", "food_location"), ("what restaurant should we go to", "food_location"), ("let's go somewhere else", "food_location"),
+ ("I'm bored", "entertainment"), ("this is boring guys", "entertainment"), ("nothing to do here", "entertainment"), ("we need something fun", "entertainment"),
+ ("game time!", "gaming"), ("let's play a game", "gaming"), ("party game anyone?", "gaming"),
+ ("drinking game time", "drinking_games"), ("never have i ever!", "drinking_games"), ("let's do a shot game", "drinking_games"),
+ ("play some music", "music"), ("any song recommendation?", "music"), ("we need good music", "music"),
+ ("trivia time!", "trivia"), ("quiz us bot", "trivia"), ("give us a brain challenge", "trivia"),
+ ("meme time", "memes"), ("show us memes", "memes"), ("need laughs", "memes"),
+ ("space adventure!", "space_adventure"), ("story time everyone", "space_adventure"), ("let's do the space mission", "space_adventure"),
+ ("roast me", "roast"), ("roast someone bot", "roast"), ("say something nice", "roast"),
+ # negatives
+ ("what time is it", None), ("I don't know where my keys are", None), ("see you tomorrow", None), ("did you see the game last night", None),
+ ("what do you mean", None), ("lol that's hilarious", None), ("I'm on my way", None), ("the train is late again", None),
+ ("what", None), ("ok", None), ("nice pic", None), ("going home now", None), ("I love this song", None), ("what now?", None),
+ ("happy birthday!!", None), ("my boss is annoying", None), ("can you send me the address", None), ("the weather is great", None),
+ ("time to sleep", None), ("I think so", None), ("where are you", None), ("who is coming tomorrow", None), ("thanks everyone", None),
+ ("I paid the rent today", None), ("the movie was good", None), ("what's up", None), ("good night", None), ("I'll be there in 5", None),
+]
+
+# Russian and Japanese chat lines for the trigger packs, inflected and unsegmented
+MULTILINGUAL_EVAL = [
+ ("Кто платит сегодня?", "payment"), ("давайте разделим счёт", "payment"), ("я платила в прошлый раз!", "payment"),
+ ("я такая голодная", "food_location"), ("где поедим вечером?", "food_location"), ("Хочу есть", "food_location"),
+ ("мне очень скучно", "entertainment"), ("давай викторину!", "trivia"), ("Давайте проголосуем", "voting"),
+ ("не могу решить что взять", "decision_making"), ("включи музыку пожалуйста", "music"), ("прожарь меня", "roast"),
+ ("увидимся завтра", None), ("который час", None), ("я уже еду", None), ("спасибо всем", None),
+ ("誰が払うの？", "payment"), ("今日は割り勘にしよう", "payment"), ("お腹すいたー", "food_location"),
+ ("腹減った、何食べる？", "food_location"), ("暇だなあ", "entertainment"), ("クイズ出して！", "trivia"),
+ ("多数決で決めよう", "voting"), ("ゲームしようよ", "gaming"), ("何か曲かけて", "music"), ("決められない…", "decision_making"),
+ ("おやすみなさい", None), ("今どこ？", None), ("ありがとう", None), ("明日会おう", None),
+]
+
+# Misspelled trigger messages that exact token matching never catches
+TYPO_EVAL = [
+    ("whos paying", "payment"), ("who payz", "payment"), ("hungy", "food_location"),
+    ("im so hungy", "food_location"), ("triva time", "trivia"), ("trivai time!", "trivia"),
+    ("lets play a gaem", "gaming"), ("roast mee", "roast"), ("meme tiem", "memes"),
+    ("drinkng game", "drinking_games"), ("im boredd", "entertainment"), ("spcae adventure", "space_adventure"),
+]
+
+
+def timed(fn, items, repeat=5):
+    """Best-of-N microseconds per item"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def score(predict, dataset=INTENT_EVAL):
+    correct = false_positive = missed = wrong = 0
+    for text, expected in dataset:
+        predicted = predict(text)
+        if expected is None:
+            false_positive += predicted is not None
+        elif predicted is None:
+            missed += 1
+        elif predicted != expected:
+            wrong += 1
+        else:
+            correct += 1
+    positives = sum(1 for _, expected in dataset if expected)
+    negatives = len(dataset) - positives
+    return (f"{correct}/{positives} correct, {wrong} wrong category, {missed} missed, "
+            f"{false_positive}/{negatives} false positives")
+
+
+def baseline_fuzzy_match(trigger_phrase, message_text, threshold=0.7):
+    """The old CrewCaptain.fuzzy_match, before the intent classifier replaced it, frozen as the comparison baseline"""
+    message_lower = message_text.lower()
+    trigger_lower = trigger_phrase.lower()
+    if len(trigger_lower.split()) == 1:
+        return bool(re.search(r'\b' + re.escape(trigger_lower) + r'\b', message_lower))
+    trigger_words = set(trigger_lower.split())
+    matches = len(trigger_words.intersection(message_lower.split()))
+    return matches >= max(1, int(len(trigger_words) * threshold))
+
+
+def bench_intent(bot):
+    """Intent classifier, alone and behind the trigger pre-filter, vs the word-overlap fuzzy matcher"""
+    def fuzzy(text):
+        for category, triggers in bot.passive_triggers.items():
+            for trigger in triggers:
+                if baseline_fuzzy_match(trigger, text):
+                    return category
+        return None
+
+    def classifier(text, threshold=0.45):
+        category, confidence, _ = bot.intent_classifier.classify(text)
+        return category if confidence >= threshold else None
+
+    def production(text):
+        """What check_passive_triggers does: vocabulary pre-filter, then the classifier"""
+        text = bot.trigger_text(text)
+        return None if text is None else classifier(text)
+
+    texts = [text for text, _ in INTENT_EVAL]
+    print(f"  fuzzy (old) : {score(fuzzy)}")
+    print(f"                {timed(fuzzy, texts):.1f} us/message")
+    print(f"  classifier  : {score(classifier)} (on its own)")
+    print(f"  pre-filtered: {score(production)} (the live path)")
+    print(f"                {timed(production, texts):.1f} us/message")
+
+
+def bench_multilingual(bot):
+    """Russian and Japanese trigger packs: whitespace tokens vs script-aware tokenizer"""
+    def classifier(text, threshold=0.45):
+        category, confidence, _ = bot.intent_classifier.classify(text)
+        return category if confidence >= threshold else None
+
+    def reaches_matcher(split):
+        hits = sum(1 for text, expected in MULTILINGUAL_EVAL
+                   if expected and not bot.trigger_vocabulary.isdisjoint(split(text)))
+        return f"{hits}/{sum(1 for _, expected in MULTILINGUAL_EVAL if expected)}"
+
+    print(f"  pre-filter  : whitespace split {reaches_matcher(lambda text: text.lower().split())} "
+          f"vs tokenize {reaches_matcher(tokenize)} triggers reach the matcher")
+    for label, dataset in (('russian', MULTILINGUAL_EVAL[:16]), ('japanese', MULTILINGUAL_EVAL[16:])):
+        print(f"  {label:<12}: {score(classifier, dataset)}")
+    texts = [text for text, _ in MULTILINGUAL_EVAL]
+    print(f"                {timed(classifier, texts):.1f} us/message")
+
+
+def bench_batch(bot):
+    """Passive classification throughput, one message at a time vs micro-batched"""
+    classifier = bot.intent_classifier
+    texts = [text for text, _ in INTENT_EVAL] * 20
+
+    def per_message(chunk):
+        for text in chunk:
+            classifier.classify(text)
+
+    print(f"  {'batch size':>10}  {'msgs/s':>9}")
+    for size in (1, 4, 16, 64):
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        fn = per_message if size == 1 else classifier.classify_batch
+        per_chunk = timed(fn, chunks, repeat=3)
+        print(f"  {size:>10}  {size / per_chunk * 1e6:>9,.0f}")
+
+
+def bench_typos(bot):
+    """Typo-tolerant lookup: symmetric-delete index vs naive edit distance over the vocabulary"""
+    spelling = bot.trigger_spelling
+    vocabulary = sorted(bot.trigger_vocabulary)
+
+    def naive(token):
+        budget = typo_budget(token)
+        best = min(vocabulary, key=lambda word: edit_distance(token, word, budget))
+        return best if edit_distance(token, best, budget) <= budget else None
+
+    tokens = [token for text, _ in TYPO_EVAL for token in tokenize(text)]
+    spelling_uncached = type(spelling)(vocabulary, cache_size=0)
+    print(f"  naive scan   : {timed(naive, tokens, repeat=3):8.1f} us/token")
+    print(f"  symspell     : {timed(spelling_uncached.lookup, tokens):8.1f} us/token (uncached)")
+    print(f"  symspell     : {timed(spelling.lookup, tokens):8.1f} us/token (cached)")
+
+    def detected(correct):
+        hits = 0
+        for text, expected in TYPO_EVAL:
+            text = bot.trigger_text(text) if correct else text
+            if text is None:
+                continue
+            category, confidence, _ = bot.intent_classifier.classify(text)
+            hits += category == expected and confidence >= 0.45
+        return hits
+
+    print(f"  typo messages detected: {detected(False)}/{len(TYPO_EVAL)} raw, "
+          f"{detected(True)}/{len(TYPO_EVAL)} with correction")
+
+
+def bench_eggs(bot):
+    """Easter eggs: per-egg substring checks vs one compiled pattern, as the egg list grows"""
+    texts = [text for text, _ in INTENT_EVAL]
+    extra = [f"{word}{n}" for n in range(200) for word in ('warp', 'nebula', 'quasar', 'hyperdrive', 'moonwalk')]
+
+    print(f"  {'eggs':>5}  {'substring':>12}  {'pattern':>12}")
+    for eggs in (list(bot.easter_eggs), list(bot.easter_eggs) + extra):
+        def naive(text):
+            lowered = text.lower()
+            return [egg for egg in eggs if egg in lowered]
+
+        pattern = phrase_pattern(eggs)
+
+        def compiled(text):
+            return pattern.findall(text.lower())
+
+        print(f"  {len(eggs):>5}  {timed(naive, texts):>9.2f} us  {timed(compiled, texts):>9.2f} us")
+
+
+def bench_scenes(bot):
+    """Space scene views for many concurrent crews on the same episode: rebuilt vs cached render"""
+    graph = bot.space_graph
+    sessions = [{'id': sid, 'node': node.id, 'crew_members': {1, 2, 3}, 'eliminated_players': {3}}
+                for sid in range(1, 9) for node in graph.nodes]
+    chats = [(-100 - chat, session) for chat in range(50) for session in sessions]
+
+    def rebuilt(item):
+        chat_id, session = item
+        head, body, rows = bot.render_space_scene(graph[session['node']])
+        text = f"{head}{session['id']}{body}\n\n👥 **Active Crew:** 2 members"
+        return text, bot.build_space_keyboard(rows, session['id'])
+
+    def cached(item):
+        chat_id, session = item
+        return bot.space_scene_view(chat_id, session)
+
+    print(f"  {len(chats):,} views ({len(graph.nodes)} scenes x 8 crews x 50 chats)")
+    print(f"  rebuilt     : {timed(rebuilt, chats, repeat=3):.2f} us/view")
+    print(f"  cached      : {timed(cached, chats, repeat=3):.2f} us/view")
+    print(f"  catalog     : {timed(lambda _: bot.render_space_catalog(), range(1000)):.2f} us rebuilt, "
+          f"{timed(lambda _: bot.space_episode_catalog, range(1000)):.2f} us cached")
+
+
+# Runs in a fresh interpreter so imports and content building are really cold
+COLDSTART_CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+from types import SimpleNamespace as NS
+import decision_bot
+imported = time.perf_counter()
+bot = decision_bot.CrewCaptain()
+built = time.perf_counter()
+replies = []
+
+async def reply_text(text, **kwargs):
+    replies.append(time.perf_counter())
+
+def update(text):
+    user = NS(id=1, first_name='Cold', username=None, is_bot=False)
+    message = NS(text=text, chat_id=-1, from_user=user, entities=[], new_chat_members=None, reply_text=reply_text)
+    return NS(message=message, effective_message=message, effective_user=user, callback_query=None,
+              effective_chat=NS(id=-1, type='group'))
+
+async def first_responses():
+    if sys.argv[1] == 'eager':
+        await bot.warm_up()
+    context = NS(args=[], bot=None, job_queue=None)
+    await bot.start(update('/start'), context)
+    await bot.handle_message(update("I'm so hungry"), context)
+
+asyncio.run(first_responses())
+print(json.dumps({'import': imported - started, 'init': built - imported,
+                  'menu': replies[0] - started, 'passive': replies[1] - started}))
+"""
+
+
+def bench_coldstart(bot):
+    """Cold start: time from interpreter start to the first menu reply and first passive reply"""
+    print(f"  {'mode':<6} {'import':>8} {'init':>8} {'1st menu':>9} {'1st passive':>12}  (median of 5, ms)")
+    for mode in ('eager', 'lazy'):
+        runs = [json.loads(subprocess.run([sys.executable, '-c', COLDSTART_CHILD, mode], capture_output=True,
+                                          text=True, check=True).stdout.splitlines()[-1]) for _ in range(5)]
+        median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+        print(f"  {mode:<6} {median['import']:>8.0f} {median['init']:>8.1f} {median['menu']:>9.0f} {median['passive']:>12.0f}")
+
+
+def populate_chats(bot, chats):
+    """Fill group_data with chats that have seen a few weeks of typical use"""
+    random.seed(7)
+    for chat in range(chats):
+        group = bot.group_data[-1000 - chat]
+        users = [NS(id=chat * 10 + n, first_name=f"Crew_{n}", username=f"crew{chat}_{n}", is_bot=False) for n in range(8)]
+        members = [ActiveMember(user.id, user.first_name) for user in users]
+        for user in users:
+            group['names'].record(user)
+            group['active_members'].touch(user)
+            group['sip_counts'][user.id] = random.randint(0, 20)
+            group['trivia_scores'][user.id] = random.randint(0, 50)
+        for _ in range(5):
+            chosen = group['payment_fairness'].choose(members, group['karma'])
+            group['payment_history'].append(group['payment_fairness'].record_payment(chosen.id, group['karma'], 4200))
+            group['karma'][chosen.id] += 1
+            group['ledger'].add_expense(chosen.id, 4200, [user.id for user in users], "who pays")
+        group['discovered_easter_eggs'].update({'legendary', 'sakura'})
+        group['space_adventure']['sessions'][1] = {
+            'id': 1, 'node': 3, 'flags': 1, 'crew_members': {user.id for user in users[:4]},
+            'eliminated_players': set(), 'round': {'node': 3, 'message_id': 5, 'votes': {}, 'deadline': time.time()},
+            'last_active': time.time()
+        }
+
+
+def bench_snapshot(bot):
+    """Checkpoint of 10k chats: pickle vs the marshal snapshot, and the event loop pause for a forked save"""
+    fresh = CrewCaptain()
+    populate_chats(fresh, 10000)
+    # serve() loads with the cyclic GC off, so measure both formats that way
+    gc.disable()
+    
+    started = time.perf_counter()
+    blob = pickle.dumps(dict(fresh.group_data), protocol=pickle.HIGHEST_PROTOCOL)
+    dumped = time.perf_counter()
+    pickle.loads(blob)
+    loaded = time.perf_counter()
+    print(f"  pickle  : {len(blob) / 1e6:6.1f} MB, save {(dumped - started) * 1000:5.0f} ms, "
+          f"load {(loaded - dumped) * 1000:5.0f} ms")
+    
+    started = time.perf_counter()
+    blob = encode_snapshot({'bot_id': 1, 'offset': 0, 'done': 0, 'chats': fresh.snapshot_chats()})
+    dumped = time.perf_counter()
+    restored = CrewCaptain()
+    restored.restore_chats(decode_snapshot(blob)['chats'])
+    loaded = time.perf_counter()
+    for chat_id in list(restored.group_data.stored):
+        restored.group_data[chat_id]
+    rebuilt = time.perf_counter()
+    print(f"  marshal : {len(blob) / 1e6:6.1f} MB, save {(dumped - started) * 1000:5.0f} ms, "
+          f"load {(loaded - dumped) * 1000:5.0f} ms (+{(rebuilt - loaded) * 1000:.0f} ms to rebuild every chat)")
+    gc.enable()
+    
+    if hasattr(os, 'fork'):
+        pauses = []
+        for _ in range(5):
+            started = time.perf_counter()
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0)
+            pauses.append(time.perf_counter() - started)
+            os.waitpid(pid, 0)
+        print(f"  fork    : {statistics.median(pauses) * 1000:.1f} ms loop pause; the child does the save above")
+
+
+def bench_migrations(bot):
+    """Upgrading 100k saved v1 chats: migrate everything at restore vs lazily on first read"""
+    template = CrewCaptain()
+    populate_chats(template, 1)
+    state = template.chat_state(template.group_data[-1000])
+    # A v1 save: no version key, trivia questions under per-user keys, display names only
+    del state['version'], state['active_questions']
+    state['names'] = state['names'][0]
+    state['active_question_10000'] = {'question': template.trivia_questions[0], 'question_id': 'q'}
+    # Marshal format 2 has no back-references, so every chat loads as its own copy
+    blob = marshal.dumps({-1000 - chat: state for chat in range(100000)}, 2)
+    gc.disable()
+    
+    eager = CrewCaptain()
+    chats = marshal.loads(blob)
+    started = time.perf_counter()
+    for chat_id, saved in chats.items():
+        eager.group_data[chat_id] = eager.chat_from_state(saved)
+    print(f"  eager   : {(time.perf_counter() - started) * 1000:6.0f} ms before the first update is handled")
+    
+    lazy = CrewCaptain()
+    chats = marshal.loads(blob)
+    started = time.perf_counter()
+    lazy.restore_chats(chats)
+    print(f"  lazy    : {(time.perf_counter() - started) * 1000:6.1f} ms at restore")
+    active = random.sample(list(chats), 1000)
+    print(f"            {timed(lambda chat_id: lazy.group_data[chat_id], active, repeat=1):6.1f} us on the first read of a chat, "
+          f"{timed(lambda chat_id: lazy.group_data[chat_id], active):.2f} us after")
+    started = time.perf_counter()
+    lazy.snapshot_chats()
+    print(f"            {(time.perf_counter() - started) * 1000:6.0f} ms to snapshot with 1% of chats loaded")
+    gc.enable()
+
+
+def bench_choices(bot):
+    """Weighted picks from a 20-option list: alias table vs random.choices, plus the cooldown ring"""
+    weights = [random.uniform(0.5, 5) for _ in range(20)]
+    options = list(range(20))
+    draws = range(100000)
+    table = AliasTable(weights)
+    print(f"  random.choices: {timed(lambda _: random.choices(options, weights), draws):.2f} us per pick")
+    print(f"  alias table   : {timed(lambda _: table.sample(), draws):.2f} us per pick, "
+          f"{timed(lambda _: AliasTable(weights), range(1000)):.1f} us per rebuild")
+    
+    choices = ChoiceList('bench', cooldown=3)
+    for option, weight in zip(options, weights):
+        choices.set(f"option {option}", weight)
+    print(f"  ChoiceList    : {timed(lambda _: choices.pick(), draws):.2f} us per pick with the last 3 on cooldown")
+
+
+def bench_schedule(bot):
+    """100k chats with all three timers: one tick's cost, and the schedule through a checkpoint"""
+    now = time.time()
+    entries = [(next_run(event, -1000 - chat, now), -1000 - chat, event)
+               for chat in range(100000) for event in SCHEDULE_TIMES]
+    started = time.perf_counter()
+    schedule = ChatSchedule(entries)
+    print(f"  build   : {(time.perf_counter() - started) * 1000:6.0f} ms for {len(entries)} timers")
+    
+    started = time.perf_counter()
+    for _ in range(1000):
+        schedule.pop_due(now)
+    print(f"  idle    : {(time.perf_counter() - started) * 1000:6.2f} us per tick with nothing due")
+    
+    # Fire one tick's worth of the earliest timers and re-arm them, as run_schedule does
+    tick = sorted(entries)[:1000]
+    started = time.perf_counter()
+    for chat_id, event, when in schedule.pop_due(tick[-1][0]):
+        schedule.add(chat_id, event, next_run(event, chat_id, when))
+    print(f"  busy    : {(time.perf_counter() - started) * 1e6 / len(tick):6.2f} us per fired timer, re-arm included")
+    
+    blob = encode_snapshot({'schedule': schedule.to_state()})
+    started = time.perf_counter()
+    ChatSchedule(decode_snapshot(blob)['schedule'])
+    print(f"  restore : {(time.perf_counter() - started) * 1000:6.0f} ms from a {len(blob) / 1e6:.1f} MB snapshot")
+
+
+BENCHMARKS = {
+    'intent': bench_intent,
+    'multilingual': bench_multilingual,
+    'batch': bench_batch,
+    'typos': bench_typos,
+    'eggs': bench_eggs,
+    'scenes': bench_scenes,
+    'coldstart': bench_coldstart,
+    'snapshot': bench_snapshot,
+    'migrations': bench_migrations,
+    'choices': bench_choices,
+    'schedule': bench_schedule,
+}
+
+
+def main(names):
+    bot = CrewCaptain()
+    for name in names or BENCHMARKS:
+        print(f"[{name}] {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name](bot)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,15 +1,35 @@
 import logging
 import random
 import asyncio
-import aiohttp
 import json
 import os
 import re
+import zlib
+import time
+import heapq
+import math
+import html
+import hmac
+import hashlib
+import signal
+import gc
+import marshal
+import struct
+import sys
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-from telegram.error import BadRequest, Forbidden
+from collections import defaultdict, deque, Counter, OrderedDict, namedtuple
+from contextlib import asynccontextmanager, nullcontext
+from functools import cached_property, lru_cache
+from itertools import chain
+import aiohttp
+import numpy as np
+from aiohttp import web
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember, InlineQueryResultArticle,
+                      InputTextMessageContent)
+from telegram.ext import (Application, CommandHandler, CallbackQueryHandler, ContextTypes, InlineQueryHandler,
+                          MessageHandler, TypeHandler, filters)
+from telegram.helpers import escape_markdown
+from telegram.error import BadRequest, Forbidden, TelegramError
 
 # Configure logging
 logging.basicConfig(
@@ -17,17 +37,1198 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Only members seen within this window count as present for who-pays, roasts and crews
+ACTIVE_MEMBER_HOURS = 12
+
+ActiveMember = namedtuple('ActiveMember', ['id', 'first_name'])
+
+TOKEN_RE = re.compile(r"[\w']+")
+
+# Kana and kanji are written without spaces, so those runs are split into character bigrams
+JAPANESE_RUN = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff66-\uff9f"
+SCRIPT_RUN_RE = re.compile(f"[{JAPANESE_RUN}]+|[^{JAPANESE_RUN}]+")
+JAPANESE_RE = re.compile(f"[{JAPANESE_RUN}]")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Common Russian inflections, longest first; stripping them maps word forms onto one stem
+RUSSIAN_REFLEXIVE = ('ся', 'сь')
+RUSSIAN_ENDINGS = tuple(sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь', 'ете', 'ишь', 'ите',
+    'ать', 'ять', 'еть', 'ить', 'ала', 'ила', 'али', 'или', 'ует', 'ают', 'яют',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей', 'ий', 'ый', 'ом', 'ем', 'ам', 'ям',
+    'ах', 'ях', 'ую', 'юю', 'ть', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ла', 'ло', 'ли',
+    'ен', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'й', 'ь'
+), key=len, reverse=True))
+
+# Log the passive pre-filter hit rate every N messages
+PASSIVE_STATS_LOG_EVERY = 1000
+
+# check_passive_triggers result for a message queued for batched classification; truthy, so
+# handle_message stops there instead of also answering with an easter egg or the menu
+PASSIVE_DEFERRED = 'deferred'
+
+# Callback prefixes whose handlers call query.answer() themselves
+# Space buttons only the active crew may press; they answer themselves so a refusal can show an alert
+SPACE_CREW_ACTIONS = ("launch", "continue", "next", "restart", "choice", "trivia", "dare")
+SELF_ANSWERING_CALLBACKS = ("vote_option_", "ledger_settle_confirm",
+                            *(f"space_{action}_" for action in SPACE_CREW_ACTIONS))
+
+# How long the crew gets to vote on a space adventure choice or trivia answer
+SPACE_VOTE_SECONDS = int(os.getenv('SPACE_VOTE_SECONDS', '30'))
+
+# Lazy indexes, cheapest and most needed first; anything still cold is built on first use
+WARM_UP_ORDER = ('trigger_phrases', 'trigger_vocabulary', 'trigger_spelling', 'space_graph',
+                 'space_scene_renders', 'space_episode_catalog', 'inline_trivia', 'intent_classifier')
+
+# Space adventure sessions untouched this long are collected; the sweep runs every few minutes
+SPACE_SESSION_IDLE_MINUTES = 60
+SPACE_SESSION_SWEEP_SECONDS = 300
+SPACE_MENU_SESSIONS = 5
+
+# Stamped scene keyboards kept per (node, session id); session ids restart at 1 in every chat
+SPACE_KEYBOARD_CACHE = 4096
+
+# Inline answers are cached this long by Telegram and by us, so a decision asked again in the window can't be re-rolled
+INLINE_CACHE_SECONDS = 30
+INLINE_CACHE_SIZE = 4096
+INLINE_MAX_RESULTS = 10
+# "pizza or sushi", "pizza, sushi, ramen", "pizza | sushi", "пицца или суши"
+INLINE_CHOICE_SPLIT = re.compile(r"\s*(?:,|\||\bor\b|\bvs\.?(?!\w)|\bили\b)\s*", re.IGNORECASE)
+
+
+def stem_russian(word):
+    """Light suffix-stripping stemmer: 'голодная', 'голодные' and 'голодна' all become 'голодн'"""
+    word = word.replace('ё', 'е')
+    for suffix in RUSSIAN_REFLEXIVE:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    for suffix in RUSSIAN_ENDINGS:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def japanese_bigrams(run):
+    if len(run) < 2:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text):
+    """Lowercase word tokens: apostrophes kept ("who's"), Russian stemmed, Japanese as bigrams"""
+    tokens = []
+    for word in TOKEN_RE.findall(text.casefold()):
+        if word.isascii():
+            tokens.append(word)
+            continue
+        for run in SCRIPT_RUN_RE.findall(word):
+            if JAPANESE_RE.match(run):
+                tokens.extend(japanese_bigrams(run))
+            elif CYRILLIC_RE.search(run):
+                tokens.append(stem_russian(run))
+            else:
+                tokens.append(run)
+    return tokens
+
+
+# MEMBER ACTIVITY INDEX
+class MemberActivityIndex:
+    """Per-chat last-seen index kept in recency order"""
+    __slots__ = ('_entries',)
+
+    def __init__(self):
+        # user_id -> [last_seen_ts, message_count], least recent first; names live in NameDirectory
+        self._entries = OrderedDict()
+
+    def touch(self, user, now=None):
+        """Record activity from a Telegram user"""
+        if user is None or user.is_bot:
+            return
+        now = now or time.time()
+        entry = self._entries.pop(user.id, None)
+        if entry is None:
+            entry = [now, 0]
+        entry[0] = now
+        entry[1] += 1
+        self._entries[user.id] = entry
+
+    def forget(self, user_id):
+        """Drop a member who left the chat"""
+        self._entries.pop(user_id, None)
+
+    def recent(self, hours=ACTIVE_MEMBER_HOURS, now=None):
+        """Ids of members active in the last N hours, most recent first (O(k))"""
+        cutoff = (now or time.time()) - hours * 3600
+        members = []
+        for user_id, (last_seen, _) in reversed(self._entries.items()):
+            if last_seen < cutoff:
+                break
+            members.append(user_id)
+        return members
+
+    def last_seen(self, user_id):
+        entry = self._entries.get(user_id)
+        return datetime.fromtimestamp(entry[0]) if entry else None
+
+    def message_count(self, user_id):
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else 0
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def to_state(self):
+        return [(user_id, last_seen, count) for user_id, (last_seen, count) in self._entries.items()]
+
+    @classmethod
+    def from_state(cls, state):
+        index = cls()
+        index._entries = OrderedDict((user_id, [last_seen, count]) for user_id, last_seen, count in state)
+        return index
+
+
+# NAME DIRECTORY
+class NameDirectory:
+    """Per-chat user id -> display name, Markdown-escaped once when a name is first seen or changes"""
+    __slots__ = ('_names', '_handles', '_usernames')
+
+    def __init__(self):
+        # user_id -> (raw name, escaped name)
+        self._names = {}
+        self._handles = {}    # user_id -> @username as last seen, kept apart from the display name
+        self._usernames = {}  # lowercase username -> user_id, for resolving @mentions
+
+    def record(self, user):
+        """Remember the name and username a Telegram user currently goes by"""
+        if user is None:
+            return
+        handle = user.username
+        if self._handles.get(user.id) != handle:
+            old = self._handles.pop(user.id, None)
+            if old and self._usernames.get(old.lower()) == user.id:
+                del self._usernames[old.lower()]
+            if handle:
+                self._handles[user.id] = handle
+                self._usernames[handle.lower()] = user.id
+        
+        raw = user.first_name or (f"@{handle}" if handle else None)
+        if raw is None:
+            return
+        known = self._names.get(user.id)
+        if known is None or known[0] != raw:
+            self._names[user.id] = (raw, escape_markdown(raw, version=1))
+
+    def get(self, user_id):
+        """Escaped display name, or a placeholder for users never seen"""
+        known = self._names.get(user_id)
+        return known[1] if known else f"User {user_id}"
+
+    def names(self, user_ids):
+        """Bulk lookup for crews and leaderboards"""
+        names = self._names
+        return [names[uid][1] if uid in names else f"User {uid}" for uid in user_ids]
+
+    def resolve(self, username):
+        """user_id behind '@username' (or 'username'), None if never seen in this chat"""
+        return self._usernames.get(username.lstrip('@').lower())
+
+    def __contains__(self, user_id):
+        return user_id in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def to_state(self):
+        return (self._names, self._handles)
+
+    @classmethod
+    def from_state(cls, state):
+        names, handles = state
+        directory = cls()
+        directory._names = {user_id: tuple(pair) for user_id, pair in names.items()}
+        directory._handles = dict(handles)
+        directory._usernames = {handle.lower(): user_id for user_id, handle in handles.items()}
+        return directory
+
+
+# PASSIVE RESPONSE POLICY
+PASSIVE_SENSITIVITY = {
+    # intent: minimum classifier score, cooldown: base seconds between responses,
+    # burst/refill: per-category token bucket size and tokens regained per minute
+    'low': {'intent': 0.55, 'cooldown': 30, 'burst': 1, 'refill': 0.5},
+    'normal': {'intent': 0.45, 'cooldown': 10, 'burst': 2, 'refill': 1.0},
+    'high': {'intent': 0.38, 'cooldown': 5, 'burst': 3, 'refill': 2.0},
+}
+
+# Chat speed (messages per minute) at which the base cooldown applies unscaled
+PASSIVE_REFERENCE_RATE = 6.0
+
+
+class PassivePolicy:
+    """Per-chat passive response rules: adaptive cooldown plus per-category token buckets"""
+    __slots__ = ('sensitivity', 'last_response', '_gap', '_last_message', '_buckets')
+
+    def __init__(self, sensitivity='normal'):
+        self.sensitivity = sensitivity
+        self.last_response = 0.0  # allow an immediate first response
+        self._gap = 60.0 / PASSIVE_REFERENCE_RATE  # EWMA of seconds between messages
+        self._last_message = None
+        self._buckets = {}  # category -> [tokens, last refill timestamp]
+
+    @property
+    def settings(self):
+        return PASSIVE_SENSITIVITY[self.sensitivity]
+
+    @property
+    def intent_threshold(self):
+        return self.settings['intent']
+
+    def observe(self, now):
+        """Feed one chat message into the message-rate estimate"""
+        if self._last_message is not None:
+            gap = min(now - self._last_message, 600.0)
+            self._gap += 0.2 * (gap - self._gap)
+        self._last_message = now
+
+    def messages_per_minute(self):
+        return 60.0 / max(self._gap, 0.1)
+
+    def cooldown(self):
+        """Base cooldown scaled by chat speed: busy chats wait longer, quiet ones less"""
+        scale = self.messages_per_minute() / PASSIVE_REFERENCE_RATE
+        return self.settings['cooldown'] * min(6.0, max(0.5, scale))
+
+    def cooling_down(self, now):
+        return now - self.last_response < self.cooldown()
+
+    def allow(self, category, now):
+        """Take a token from the category bucket, False if it is empty"""
+        settings = self.settings
+        bucket = self._buckets.get(category)
+        if bucket is None:
+            bucket = self._buckets[category] = [float(settings['burst']), now]
+        else:
+            refilled = bucket[0] + (now - bucket[1]) * settings['refill'] / 60.0
+            bucket[0] = min(float(settings['burst']), refilled)
+            bucket[1] = now
+        
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def responded(self, now):
+        self.last_response = now
+
+    def to_state(self):
+        return (self.sensitivity, self.last_response, self._gap, self._last_message, self._buckets)
+
+    @classmethod
+    def from_state(cls, state):
+        policy = cls(state[0])
+        policy.last_response, policy._gap, policy._last_message, policy._buckets = state[1:]
+        return policy
+
+
+# INTENT CLASSIFIER
+INTENT_DIM = 1 << 12
+INTENT_NGRAMS = (3, 4)
+
+
+@lru_cache(maxsize=65536)
+def word_ngram_ids(word, dim=INTENT_DIM):
+    """Hashed character n-grams of one word, padded so word edges get their own grams"""
+    word = f" {word} "
+    # crc32 rather than hash() so buckets are stable across processes
+    return tuple(
+        zlib.crc32(word[i:i + n].encode()) & (dim - 1)
+        for n in INTENT_NGRAMS for i in range(len(word) - n + 1)
+    )
+
+
+def char_ngram_ids(text, dim=INTENT_DIM):
+    """Hashed character n-grams of every word in text (chat vocabulary repeats, so words are cached)"""
+    ids = []
+    for word in tokenize(text):
+        ids.extend(word_ngram_ids(word, dim))
+    return ids
+
+
+class IntentClassifier:
+    """TF-IDF over hashed character n-grams, scored against category centroids and exemplars"""
+
+    def __init__(self, trigger_sets, dim=INTENT_DIM):
+        self.dim = dim
+        self.categories = list(trigger_sets)
+        self.phrases = [phrase for category in self.categories for phrase in trigger_sets[category]]
+        labels = np.array([i for i, category in enumerate(self.categories) for _ in trigger_sets[category]])
+        
+        # Trained once from the trigger phrases: IDF over phrases, then one column per
+        # category centroid followed by one column per exemplar phrase
+        doc_freq = np.zeros(dim, dtype=np.float32)
+        for phrase in self.phrases:
+            doc_freq[list(set(char_ngram_ids(phrase, dim)))] += 1
+        self.idf = (np.log((1 + len(self.phrases)) / (1 + doc_freq)) + 1).astype(np.float32)
+        
+        exemplars = np.zeros((len(self.phrases), dim), dtype=np.float32)
+        for row, phrase in enumerate(self.phrases):
+            ids, weights = self.vectorize(phrase)
+            exemplars[row, ids] = weights
+        centroids = np.stack([exemplars[labels == i].mean(axis=0) for i in range(len(self.categories))])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        
+        # Stored n-gram-major so a message only gathers the rows of the n-grams it contains
+        self.matrix = np.ascontiguousarray(np.vstack([centroids, exemplars]).T)
+        self._starts = np.searchsorted(labels, np.arange(len(self.categories)))
+
+    def vectorize(self, text):
+        """Sparse L2-normalised sublinear TF-IDF vector as (n-gram ids, weights)"""
+        ids, counts = np.unique(np.array(char_ngram_ids(text, self.dim), dtype=np.int64), return_counts=True)
+        if not len(ids):
+            return ids, np.zeros(0, dtype=np.float32)
+        weights = (1.0 + np.log(counts)) * self.idf[ids]
+        return ids, (weights / np.linalg.norm(weights)).astype(np.float32)
+
+    def category_scores(self, raw):
+        """Blend centroid similarity with the best exemplar similarity per category"""
+        k = len(self.categories)
+        best_exemplar = np.maximum.reduceat(raw[..., k:], self._starts, axis=-1)
+        return 0.5 * raw[..., :k] + 0.5 * best_exemplar
+
+    def closest_phrase(self, raw, category_index):
+        k = len(self.categories)
+        start = self._starts[category_index]
+        end = self._starts[category_index + 1] if category_index + 1 < k else len(self.phrases)
+        return self.phrases[start + int(raw[k + start:k + end].argmax())]
+
+    def classify(self, text):
+        """Return (category, score, closest trigger phrase) with one matrix-vector product"""
+        ids, weights = self.vectorize(text)
+        if not len(ids):
+            return self.categories[0], 0.0, self.phrases[0]
+        raw = weights @ self.matrix[ids]
+        scores = self.category_scores(raw)
+        best = int(scores.argmax())
+        return self.categories[best], float(scores[best]), self.closest_phrase(raw, best)
+
+    def classify_batch(self, texts):
+        """Classify many messages with a single matrix product over their shared n-grams"""
+        grams = [char_ngram_ids(text, self.dim) for text in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(ids) for ids in grams])
+        if not len(rows):
+            return [(self.categories[0], 0.0, self.phrases[0]) for _ in texts]
+        
+        # One unique over (message, n-gram) keys builds every TF-IDF vector at once
+        keys, counts = np.unique(rows * self.dim + np.fromiter(chain.from_iterable(grams), dtype=np.int64),
+                                 return_counts=True)
+        rows, ids = np.divmod(keys, self.dim)
+        weights = ((1.0 + np.log(counts)) * self.idf[ids]).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(texts)))
+        weights /= norms[rows]
+        
+        used, columns = np.unique(ids, return_inverse=True)
+        batch = np.zeros((len(texts), len(used)), dtype=np.float32)
+        batch[rows, columns] = weights
+        
+        raw = batch @ self.matrix[used]
+        scores = self.category_scores(raw)
+        best = scores.argmax(axis=1)
+        return [
+            (self.categories[b], float(scores[i, b]), self.closest_phrase(raw[i], b))
+            for i, b in enumerate(best)
+        ]
+
+
+# TYPO-TOLERANT TRIGGER LOOKUP
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (adjacent swaps count once), or limit + 1 past the limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def typo_budget(word):
+    """Edits tolerated for a word of this length: none for short words, 2 for long ones"""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def deletes(word, distance):
+    """Every string reachable from word by up to distance character deletions"""
+    found = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+class SymSpellIndex:
+    """Symmetric-delete spelling index over the trigger vocabulary"""
+
+    def __init__(self, vocabulary, cache_size=20000):
+        self.vocabulary = frozenset(vocabulary)
+        self._deletes = defaultdict(set)
+        for word in self.vocabulary:
+            for variant in deletes(word, typo_budget(word)):
+                self._deletes[variant].add(word)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def lookup(self, token):
+        """Closest vocabulary word within the typo budget, or None"""
+        if token in self.vocabulary:
+            return token
+        if token in self._cache:
+            self._cache.move_to_end(token)
+            return self._cache[token]
+        
+        budget = typo_budget(token)
+        best, best_distance = None, budget + 1
+        if budget:
+            candidates = set()
+            for variant in deletes(token, budget):
+                candidates |= self._deletes.get(variant, set())
+            # Closest first, then the longer word ("whos" -> "who's" rather than "who")
+            for word in sorted(candidates, key=lambda w: (-len(w), w)):
+                distance = edit_distance(token, word, min(budget, typo_budget(word)))
+                if distance < best_distance:
+                    best, best_distance = word, distance
+        
+        self._cache[token] = best
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return best
+
+    def correct(self, tokens):
+        """Tokens with typos of trigger words replaced; unknown words pass through unchanged"""
+        return [self.lookup(token) or token for token in tokens]
+
+
+# PASSIVE MICRO-BATCHING
+# Higher in the list wins when several buffered messages trigger at once
+PASSIVE_PRIORITY = [
+    'summoning', 'payment', 'decision_making', 'voting', 'food_location', 'drinking_games',
+    'trivia', 'gaming', 'music', 'memes', 'space_adventure', 'roast', 'entertainment'
+]
+
+
+class PassiveBatcher:
+    """Buffers a chat's candidate messages for a few milliseconds and flushes them together"""
+
+    def __init__(self, flush, window_ms):
+        self.window = window_ms / 1000
+        self._flush = flush
+        self._buffers = {}
+        self._flushing = set()
+        self.batches = 0
+        self.messages = 0
+
+    def add(self, chat_id, item):
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            buffer = self._buffers[chat_id] = []
+            asyncio.get_running_loop().call_later(self.window, self._dispatch, chat_id)
+        buffer.append(item)
+
+    def _dispatch(self, chat_id):
+        items = self._buffers.pop(chat_id, None)
+        if items:
+            self.batches += 1
+            self.messages += len(items)
+            task = asyncio.ensure_future(self._flush(chat_id, items))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+            task.add_done_callback(self._report)
+
+    async def drain(self):
+        """Flush every buffer now and wait for the flushes, e.g. before shutting down"""
+        for chat_id in list(self._buffers):
+            self._dispatch(chat_id)
+        if self._flushing:
+            await asyncio.wait(list(self._flushing))
+
+    @staticmethod
+    def _report(task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Passive batch failed: {task.exception()}")
+
+
+# PAYMENT FAIRNESS ENGINE
+PAYMENT_HALF_LIFE_DAYS = 30
+PAYMENT_HISTORY_LIMIT = 500
+
+
+class FenwickTree:
+    """Prefix-sum tree over slot weights for O(log n) weighted sampling"""
+    __slots__ = ('_tree', '_weights')
+
+    def __init__(self):
+        self._tree = [0.0]  # 1-indexed
+        self._weights = []
+
+    def _prefix(self, i):
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def append(self, weight):
+        """Add a slot and return its index"""
+        self._weights.append(weight)
+        i = len(self._weights)
+        self._tree.append(weight + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+        return i - 1
+
+    def update(self, index, weight):
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def weight(self, index):
+        return self._weights[index]
+
+    def total(self):
+        return self._prefix(len(self._weights))
+
+    def find(self, target):
+        """Index of the slot whose cumulative weight range contains target"""
+        pos = 0
+        step = 1 << (len(self._weights).bit_length())
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(pos, len(self._weights) - 1)
+
+    def __len__(self):
+        return len(self._weights)
+
+    @classmethod
+    def from_weights(cls, weights):
+        """Build the tree for known weights in O(n)"""
+        tree = cls()
+        tree._weights = list(weights)
+        tree._tree = [0.0] + tree._weights
+        for i in range(1, len(tree._tree)):
+            parent = i + (i & -i)
+            if parent < len(tree._tree):
+                tree._tree[parent] += tree._tree[i]
+        return tree
+
+
+def zero_totals():
+    """Default per-user payment totals: [times paid, amount paid]"""
+    return [0, 0.0]
+
+
+class PaymentFairness:
+    """Weighted who-pays picker: people who paid recently are less likely to be chosen"""
+    __slots__ = ('half_life', '_epoch', '_scores', '_slots', '_users', '_tree',
+                 '_refreshed_at', '_mean_amount', '_amount_count', 'totals')
+
+    def __init__(self, half_life_days=PAYMENT_HALF_LIFE_DAYS):
+        self.half_life = half_life_days * 86400 if half_life_days else None
+        self._epoch = time.time()
+        self._scores = []  # payment score per slot, inflated to _epoch so decay stays lazy
+        self._slots = {}
+        self._users = []
+        self._tree = FenwickTree()
+        self._refreshed_at = self._epoch
+        self._mean_amount = 0.0
+        self._amount_count = 0
+        self.totals = defaultdict(zero_totals)  # user_id -> [times paid, amount paid]
+
+    def _growth(self, now):
+        if not self.half_life:
+            return 1.0
+        return 2.0 ** ((now - self._epoch) / self.half_life)
+
+    def _weight(self, slot, growth):
+        return 1.0 / (1.0 + self._scores[slot] / growth)
+
+    def _ensure(self, user_id, karma):
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = len(self._users)
+            self._slots[user_id] = slot
+            self._users.append(user_id)
+            # Seed from karma earned before the engine existed, at the growth the other weights are on
+            growth = self._growth(self._refreshed_at)
+            self._scores.append(float(karma.get(user_id, 0)) * growth)
+            self._tree.append(self._weight(slot, growth))
+        return slot
+
+    def _refresh(self, now):
+        """Re-weight every slot once decay has drifted far enough to matter"""
+        growth = self._growth(now)
+        if growth / self._growth(self._refreshed_at) < 1.05:
+            return
+        if growth > 2.0 ** 32:
+            # Re-base before the inflated scores lose precision
+            self._scores = [score / growth for score in self._scores]
+            self._epoch = now
+            growth = 1.0
+        self._refreshed_at = now
+        for slot in range(len(self._users)):
+            self._tree.update(slot, self._weight(slot, growth))
+
+    def choose(self, members, karma):
+        """Pick a payer from members, weighted towards people who paid least lately"""
+        now = time.time()
+        eligible = {member.id: member for member in members}
+        for user_id in eligible:
+            self._ensure(user_id, karma)
+        self._refresh(now)
+
+        total = self._tree.total()
+        for _ in range(8):
+            user_id = self._users[self._tree.find(random.random() * total)]
+            if user_id in eligible:
+                return eligible[user_id]
+
+        # Mostly-absent group: fall back to sampling the present members directly
+        weights = [self._tree.weight(self._slots[user_id]) for user_id in eligible]
+        return random.choices(list(eligible.values()), weights=weights)[0]
+
+    def record_payment(self, user_id, karma, amount=None):
+        """Charge a payment to user_id and return its audit entry"""
+        now = time.time()
+        slot = self._ensure(user_id, karma)
+
+        units = 1.0
+        if amount and not math.isfinite(amount):
+            amount = None  # a NaN or inf would poison the mean and every weight in the chat
+        if amount:
+            self._amount_count += 1
+            self._mean_amount += (amount - self._mean_amount) / self._amount_count
+            units = amount / self._mean_amount
+
+        growth = self._growth(now)
+        self._scores[slot] += units * growth
+        self._tree.update(slot, self._weight(slot, growth))
+
+        totals = self.totals[user_id]
+        totals[0] += 1
+        totals[1] += amount or 0.0
+        return {
+            'user_id': user_id,
+            'amount': amount,
+            'time': datetime.fromtimestamp(now),
+            'weight_after': round(self._tree.weight(slot), 4)
+        }
+
+    def to_state(self):
+        return (self.half_life, self._epoch, self._scores, self._users, self._tree._weights,
+                self._refreshed_at, self._mean_amount, self._amount_count, dict(self.totals))
+
+    @classmethod
+    def from_state(cls, state):
+        fairness = cls()
+        (fairness.half_life, fairness._epoch, fairness._scores, fairness._users, weights,
+         fairness._refreshed_at, fairness._mean_amount, fairness._amount_count, totals) = state
+        fairness._slots = {user_id: slot for slot, user_id in enumerate(fairness._users)}
+        fairness._tree = FenwickTree.from_weights(weights)
+        fairness.totals.update(totals)
+        return fairness
+
+
+# BILL SPLITTING LEDGER
+def parse_amount(text):
+    """Parse '42', '42.50' or '42,50' into integer cents, None if invalid"""
+    try:
+        amount = float(text.replace(',', '.'))
+        if not math.isfinite(amount):
+            return None
+        cents = round(amount * 100)
+    except (ValueError, AttributeError, OverflowError):
+        return None
+    return cents if cents > 0 else None
+
+
+def format_cents(cents):
+    return f"{cents / 100:.2f}"
+
+
+class ExpenseLedger:
+    """Shared expenses with incrementally maintained net balances (in cents)"""
+    __slots__ = ('balances', 'expenses', 'settlements')
+
+    def __init__(self):
+        self.balances = defaultdict(int)  # user_id -> cents owed to them (negative = owes)
+        self.expenses = []  # (timestamp, payer_id, cents, participant_ids, description)
+        self.settlements = []  # (timestamp, from_id, to_id, cents)
+
+    def add_expense(self, payer_id, cents, participant_ids, description=''):
+        """Record an expense split evenly between participants"""
+        participants = list(dict.fromkeys(participant_ids))
+        if not participants:
+            participants = [payer_id]
+        share, remainder = divmod(cents, len(participants))
+        
+        self.balances[payer_id] += cents
+        for i, user_id in enumerate(participants):
+            # Spread leftover cents over the first participants so totals always balance
+            self.balances[user_id] -= share + (1 if i < remainder else 0)
+        
+        self.expenses.append((time.time(), payer_id, cents, tuple(participants), description))
+
+    def balance(self, user_id):
+        return self.balances.get(user_id, 0)
+
+    def settle_up(self):
+        """Greedy debt simplification: at most n-1 transfers as (from_id, to_id, cents)"""
+        creditors = [(-amount, user_id) for user_id, amount in self.balances.items() if amount > 0]
+        debtors = [(amount, user_id) for user_id, amount in self.balances.items() if amount < 0]
+        heapq.heapify(creditors)
+        heapq.heapify(debtors)
+        
+        transfers = []
+        while creditors and debtors:
+            credit, creditor = heapq.heappop(creditors)
+            debt, debtor = heapq.heappop(debtors)
+            amount = min(-credit, -debt)
+            transfers.append((debtor, creditor, amount))
+            if -credit > amount:
+                heapq.heappush(creditors, (credit + amount, creditor))
+            if -debt > amount:
+                heapq.heappush(debtors, (debt + amount, debtor))
+        return transfers
+
+    def record_transfer(self, from_id, to_id, cents):
+        self.balances[from_id] += cents
+        self.balances[to_id] -= cents
+        for user_id in (from_id, to_id):
+            if self.balances[user_id] == 0:
+                del self.balances[user_id]
+        self.settlements.append((time.time(), from_id, to_id, cents))
+
+    def to_state(self):
+        return (dict(self.balances), self.expenses, self.settlements)
+
+    @classmethod
+    def from_state(cls, state):
+        ledger = cls()
+        ledger.balances.update(state[0])
+        ledger.expenses, ledger.settlements = list(state[1]), list(state[2])
+        return ledger
+
+
+# CUSTOM CHOICE LISTS
+CHOICE_LIST_LIMIT = 12     # lists per chat
+CHOICE_OPTION_LIMIT = 20   # options per list, so a vote on it still fits one keyboard
+CHOICE_NAME = re.compile(r'\w{1,16}')
+CHOICE_NAME_BYTES = 52     # UTF-8 bytes; "choose_list_" + name has to fit Telegram's 64-byte callback data
+CHOICE_WEIGHT_LIMIT = 1000 # far past any real preference, and keeps the sum of weights finite
+CHOICE_COOLDOWN = 1        # by default the last pick is never picked twice in a row
+CHOICE_RETRIES = 8
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) per weighted sample"""
+    __slots__ = ('prob', 'alias')
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        self.prob = [1.0] * n  # columns left over at the end are full, up to float error
+        self.alias = list(range(n))
+        
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+
+    def sample(self):
+        column = int(random.random() * len(self.prob))
+        return column if random.random() < self.prob[column] else self.alias[column]
+
+
+class ChoiceList:
+    """A chat's own weighted options, with the last few picks on cooldown"""
+    __slots__ = ('title', 'options', 'weights', 'recent', '_table')
+
+    def __init__(self, title, cooldown=CHOICE_COOLDOWN):
+        self.title = title
+        self.options = []
+        self.weights = []
+        self.recent = deque(maxlen=cooldown)  # ring buffer of the latest picks
+        self._table = None  # rebuilt on the first pick after a change
+
+    def set(self, option, weight=1.0):
+        if option in self.options:
+            self.weights[self.options.index(option)] = weight
+        else:
+            self.options.append(option)
+            self.weights.append(weight)
+        self._table = None
+
+    def remove(self, option):
+        if option not in self.options:
+            return False
+        i = self.options.index(option)
+        del self.options[i], self.weights[i]
+        if option in self.recent:
+            self.recent = deque((o for o in self.recent if o != option), maxlen=self.recent.maxlen)
+        self._table = None
+        return True
+
+    def set_cooldown(self, picks):
+        self.recent = deque(self.recent, maxlen=picks)
+
+    def pick(self):
+        """Weighted pick that skips anything on cooldown"""
+        if not self.options:
+            return None
+        if self._table is None:
+            self._table = AliasTable(self.weights)
+        
+        # A cooldown as long as the list would block everything, so the oldest pick is let back in
+        recent = self.recent
+        if len(recent) >= len(self.options):
+            recent = list(recent)[len(recent) - len(self.options) + 1:]
+        
+        # Cooled-down options are rejected and redrawn; with a short buffer that almost never repeats
+        for _ in range(CHOICE_RETRIES):
+            chosen = self.options[self._table.sample()]
+            if chosen not in recent:
+                break
+        else:
+            eligible = [(o, w) for o, w in zip(self.options, self.weights) if o not in recent]
+            chosen = random.choices([o for o, _ in eligible], [w for _, w in eligible])[0]
+        
+        self.recent.append(chosen)
+        return chosen
+
+    def to_state(self):
+        return (self.title, self.options, self.weights, list(self.recent), self.recent.maxlen)
+
+    @classmethod
+    def from_state(cls, state):
+        title, options, weights, recent, cooldown = state
+        choices = cls(title, cooldown)
+        choices.options, choices.weights = list(options), list(weights)
+        choices.recent.extend(recent)
+        return choices
+
+
+class ChoiceLists(dict):
+    """name -> ChoiceList for one chat"""
+
+    def to_state(self):
+        return {name: choices.to_state() for name, choices in self.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls((name, ChoiceList.from_state(choices)) for name, choices in state.items())
+
+
+def parse_weighted(text):
+    """'Pub:3, Sake Bar, Rooftop:0.5' -> [('Pub', 3.0), ('Sake Bar', 1.0), ('Rooftop', 0.5)]"""
+    parsed = []
+    for item in text.split(','):
+        option, _, weight = item.strip().rpartition(':')
+        try:
+            weight = float(weight)
+        except ValueError:
+            option, weight = item.strip(), 1.0
+        option = option.strip()[:40]
+        if option and 0 < weight <= CHOICE_WEIGHT_LIMIT:
+            parsed.append((option, weight))
+    return parsed
+
+
+# EASTER EGG MATCHING
+def phrase_pattern(phrases):
+    """Compile phrases into one trie-shaped regex, so each position checks one branch per character"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A phrase ending here is still a match, but prefer the longer one
+        return f'(?:{body})?' if '' in node else body
+
+    return re.compile(build(trie))
+
+
+# SPACE ADVENTURE SCENE GRAPH
+# State flags a crew can pick up along the way, one bit each
+SPACE_FLAGS = ('heat', 'stealth')
+
+SceneNode = namedtuple('SceneNode', ['id', 'episode', 'scene', 'type', 'text', 'options', 'question', 'answer', 'dare', 'edges', 'effects'])
+Consequence = namedtuple('Consequence', ['name', 'text', 'sets', 'eliminate', 'skip'])
+
+
+class SceneGraph:
+    """Episodes compiled into numbered scene nodes with precomputed, consequence-driven edges"""
+    END = -1
+
+    def __init__(self, episodes, consequences):
+        self.flag_bits = {name: 1 << i for i, name in enumerate(SPACE_FLAGS)}
+        self.consequences = {name: self.compile_consequence(name, spec) for name, spec in consequences.items()}
+        self.episodes = episodes
+        self.episode_start = []
+        self.nodes = []
+
+        # Scenes are numbered in reading order, so "next scene" is always id + 1
+        for episode in episodes:
+            if not episode['scenes']:
+                raise ValueError(f"Episode {episode['title']!r} has no scenes")
+            self.episode_start.append(sum(len(e['scenes']) for e in episodes[:len(self.episode_start)]))
+        for episode_idx, episode in enumerate(episodes):
+            for scene_idx, scene in enumerate(episode['scenes']):
+                self.nodes.append(self.compile_scene(len(self.nodes), episode_idx, scene_idx, scene))
+        self.validate()
+
+    def compile_consequence(self, name, spec):
+        unknown = set(spec.get('flags', ())) - set(self.flag_bits)
+        if unknown:
+            raise ValueError(f"Consequence {name!r} sets unknown flags {sorted(unknown)}")
+        sets = sum(self.flag_bits[flag] for flag in spec.get('flags', ()))
+        return Consequence(name, spec['text'], sets, spec.get('eliminate'), spec.get('skip', 0))
+
+    def target(self, episode_idx, scene_idx):
+        """Node id of a scene, rolling over into the next episode (or END) past the last one"""
+        if scene_idx < len(self.episodes[episode_idx]['scenes']):
+            return self.episode_start[episode_idx] + scene_idx
+        if episode_idx + 1 < len(self.episodes):
+            return self.episode_start[episode_idx + 1]
+        return self.END
+
+    def compile_scene(self, node_id, episode_idx, scene_idx, scene):
+        where = f"{self.episodes[episode_idx]['title']!r} scene {scene_idx + 1}"
+        kind = scene['type'] if scene['type'] != 'challenge' else scene['challenge_type']
+        options, effects = tuple(scene.get('options', ())), ()
+
+        if kind == 'choice':
+            names = scene.get('consequences', [])
+            if len(names) != len(options) or not options:
+                raise ValueError(f"{where}: every choice option needs exactly one consequence")
+            missing = [name for name in names if name not in self.consequences]
+            if missing:
+                raise ValueError(f"{where}: unknown consequences {missing}")
+            effects = tuple(self.consequences[name] for name in names)
+            edges = tuple(self.target(episode_idx, scene_idx + 1 + effect.skip) for effect in effects)
+        elif kind in ('story', 'trivia', 'dare'):
+            if kind == 'trivia' and scene.get('answer') not in options:
+                raise ValueError(f"{where}: trivia answer is not one of the options")
+            if kind == 'dare' and not scene.get('dare'):
+                raise ValueError(f"{where}: dare scene without a dare")
+            edges = (self.target(episode_idx, scene_idx + 1),)
+        else:
+            raise ValueError(f"{where}: unknown scene type {kind!r}")
+
+        return SceneNode(node_id, episode_idx, scene_idx, kind, scene['text'], options,
+                         scene.get('question'), scene.get('answer'), scene.get('dare'), edges, effects)
+
+    def validate(self):
+        """Every node must be reachable from the start; a consequence's skip can jump over scenes for good.
+        Edges only ever point forward (or to END), so every node reaches the end by construction."""
+        reachable, stack = {0}, [0]
+        while stack:
+            for target in self.nodes[stack.pop()].edges:
+                if target != self.END and target not in reachable:
+                    reachable.add(target)
+                    stack.append(target)
+
+        for node in self.nodes:
+            if node.id not in reachable:
+                where = f"{self.episodes[node.episode]['title']!r} scene {node.scene + 1}"
+                raise ValueError(f"{where} can never be reached")
+
+    def __getitem__(self, node_id):
+        return self.nodes[node_id]
+
+    def has_flag(self, flags, name):
+        return bool(flags & self.flag_bits[name])
+
+    def clear_flag(self, flags, name):
+        return flags & ~self.flag_bits[name]
+
+
+# SCHEDULED EVENTS
+SCHEDULE_TICK_SECONDS = 60
+# Local hour and weekday (None = daily) of each per-chat event
+SCHEDULE_TIMES = {
+    'mood': (0, None),
+    'trivia': (int(os.getenv('TRIVIA_OF_THE_DAY_HOUR', '12')), None),
+    'payday': (int(os.getenv('PAYDAY_REMINDER_HOUR', '18')), 4),  # Friday
+}
+# Chats fire spread over this window instead of all on the hour, to stay under Telegram's send limits
+SCHEDULE_SPREAD_SECONDS = 900
+# Events missed by more than this while the bot was down are skipped, except the (silent) mood change
+SCHEDULE_GRACE_SECONDS = 3600
+DAY_MOODS = ['cyberpunk', 'pokemon', 'starwars', 'anime', 'gaming', 'dramatic', 'pirate']
+
+
+def next_run(event, chat_id, now):
+    """Timestamp of the event's next occurrence for this chat, strictly after now"""
+    hour, weekday = SCHEDULE_TIMES[event]
+    when = (datetime.fromtimestamp(now).replace(hour=hour, minute=0, second=0, microsecond=0)
+            + timedelta(seconds=chat_id % SCHEDULE_SPREAD_SECONDS))
+    step = timedelta(days=1 if weekday is None else 7)
+    if weekday is not None:
+        when += timedelta(days=(weekday - when.weekday()) % 7)
+    while when.timestamp() <= now:
+        when += step
+    return when.timestamp()
+
+
+class ChatSchedule:
+    """Every chat's timers in one min-heap, so a tick costs O(log n) per due event however many chats there are"""
+
+    def __init__(self, entries=()):
+        self.due = {(chat_id, event): when for when, chat_id, event in entries}  # the live timers
+        self.heap = [(when, chat_id, event) for (chat_id, event), when in self.due.items()]
+        heapq.heapify(self.heap)
+        self.revision = 0  # bumped on every change, so the checkpoint knows to save
+
+    def add(self, chat_id, event, when):
+        self.due[(chat_id, event)] = when
+        heapq.heappush(self.heap, (when, chat_id, event))
+        self.revision += 1
+
+    def cancel(self, chat_id, event):
+        # The heap entry stays behind and is skipped when it surfaces
+        if self.due.pop((chat_id, event), None) is not None:
+            self.revision += 1
+        if len(self.heap) > 2 * len(self.due) + 1024:
+            self.heap = [(when, chat_id, event) for (chat_id, event), when in self.due.items()]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now):
+        """Remove and return the timers due by now as (chat_id, event, when), earliest first"""
+        fired = []
+        while self.heap and self.heap[0][0] <= now:
+            when, chat_id, event = heapq.heappop(self.heap)
+            if self.due.get((chat_id, event)) == when:
+                del self.due[(chat_id, event)]
+                fired.append((chat_id, event, when))
+        if fired:
+            self.revision += 1
+        return fired
+
+    def to_state(self):
+        return [(when, chat_id, event) for (chat_id, event), when in self.due.items()]
+
+
+# CHAT STATE
+# Saved chats carry this version; older ones are upgraded by CHAT_MIGRATIONS when first read
+CHAT_SCHEMA_VERSION = 3
+
+
+def migrate_chat_v1(state):
+    """v1 kept each user's open trivia question under its own active_question_{user_id} key"""
+    questions = {}
+    for key in [key for key in state if key.startswith('active_question_')]:
+        questions[int(key[len('active_question_'):])] = state.pop(key)
+    state['active_questions'] = questions
+    return state
+
+
+def migrate_chat_v2(state):
+    """v2 saved only display names; usernames fill in as members are seen again"""
+    if 'names' in state:
+        state['names'] = (state['names'], {})
+    return state
+
+
+# version -> function upgrading a saved chat from that version to the next
+CHAT_MIGRATIONS = {
+    1: migrate_chat_v1,
+    2: migrate_chat_v2,
+}
+
+
+def migrate_chat(state):
+    version = state.pop('version', 1)
+    while version < CHAT_SCHEMA_VERSION:
+        state = CHAT_MIGRATIONS[version](state)
+        version += 1
+    return state
+
+
+class GroupStore(dict):
+    """chat_id -> chat state; restored chats stay in their saved form until first read, then migrate and load"""
+
+    def __init__(self, factory, load):
+        super().__init__()
+        self.factory = factory  # a fresh chat
+        self.load = load        # saved chat state -> live chat
+        self.stored = {}        # chat_id -> saved state nobody has read yet
+
+    def __missing__(self, chat_id):
+        state = self.stored.pop(chat_id, None)
+        group = self.factory() if state is None else self.load(state)
+        self[chat_id] = group
+        return group
+
+
+# Per-chat helpers that save themselves through to_state() / from_state()
+CHAT_OBJECTS = {
+    'names': NameDirectory,
+    'payment_fairness': PaymentFairness,
+    'ledger': ExpenseLedger,
+    'active_members': MemberActivityIndex,
+    'passive_policy': PassivePolicy,
+    'choice_lists': ChoiceLists,
+}
+# defaultdict(int) tallies, saved as plain dicts
+CHAT_COUNTERS = ('karma', 'sip_counts', 'trivia_scores')
+
+
 class CrewCaptain:
     def __init__(self):
         # Store group data (in production, use a proper database)
-        self.group_data = defaultdict(lambda: {
+        self.group_data = GroupStore(lambda: {
             'karma': defaultdict(int),
             'last_payer': None,
             'mood': 'normal',
-            'nicknames': {},
+            'names': NameDirectory(),
             'payment_history': [],
+            'payment_fairness': PaymentFairness(),
+            'ledger': ExpenseLedger(),
             'lottery_entries': set(),
-            'active_members': set(),
+            'active_members': MemberActivityIndex(),
             'vote_history': [],
             'active_votes': {},
             'sip_counts': defaultdict(int),
@@ -37,17 +1238,15 @@ class CrewCaptain:
             'music_stats': {'total_plays': 0, 'by_category': defaultdict(int), 'recent_songs': []},
             'meme_stats': {'total_memes': 0, 'by_subreddit': defaultdict(int), 'recent_memes': []},
             'space_adventure': {
-                'current_episode': 0,
-                'current_scene': 0,
-                'crew_members': set(),
-                'eliminated_players': set(),
-                'story_choices': [],
-                'active_game': False,
+                'sessions': {},  # session id -> crew state, see space_start_new_game
+                'next_session': 0,
                 'game_stats': defaultdict(int)
             },
-            'last_passive_response': datetime.now() - timedelta(minutes=5),  # Allow immediate first response
-            'passive_triggers_enabled': True
-        })
+            'passive_policy': PassivePolicy(),
+            'passive_triggers_enabled': True,
+            'active_questions': {},  # user_id -> the trivia question they are answering
+            'choice_lists': ChoiceLists()
+        }, self.chat_from_state)
         
         # YouTube API configuration
         self.YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
@@ -143,6 +1342,51 @@ class CrewCaptain:
             ]
         }
         
+        # Russian and Japanese trigger packs for the same categories
+        self.passive_trigger_packs = {
+            'en': self.passive_triggers,
+            'ru': {
+                'summoning': ["эй бот", "бот помоги", "капитан помоги", "позовите бота", "бот ты тут"],
+                'decision_making': ["не могу решить", "не знаю что выбрать", "решайте сами", "что выберем",
+                                    "помогите выбрать", "есть идеи"],
+                'payment': ["кто платит", "кто угощает", "кто оплачивает", "я платил в прошлый раз",
+                            "разделим счёт", "чья очередь платить", "счёт пожалуйста"],
+                'voting': ["давайте проголосуем", "голосование", "решим голосованием", "большинство решает"],
+                'food_location': ["я голодный", "хочу есть", "где поедим", "куда пойдём есть", "какой ресторан",
+                                  "пойдём куда-нибудь ещё", "что на ужин"],
+                'entertainment': ["мне скучно", "скучно", "нечего делать", "развлеки нас", "что дальше"],
+                'gaming': ["давайте поиграем", "время игры", "во что поиграем", "командная игра"],
+                'drinking_games': ["игра с выпивкой", "я никогда не", "алкогольная игра", "давайте выпьем"],
+                'music': ["включи музыку", "какую песню", "давай музыку", "посоветуй песню"],
+                'trivia': ["викторина", "давай викторину", "проверь наши знания", "вопрос на засыпку"],
+                'memes': ["мемы", "покажи мемы", "хочу посмеяться", "что-нибудь смешное"],
+                'space_adventure': ["космическое приключение", "время историй", "космическая миссия"],
+                'roast': ["прожарь меня", "прожарь кого-нибудь", "скажи что-нибудь приятное", "подколи кого-нибудь"]
+            },
+            'ja': {
+                'summoning': ["ボットさん", "ボット助けて", "キャプテン助けて", "ボットいる"],
+                'decision_making': ["決められない", "どうしよう", "迷ってる", "誰か決めて", "何がいいかな"],
+                'payment': ["誰が払う", "誰のおごり", "割り勘にしよう", "お会計", "前回払った"],
+                'voting': ["投票しよう", "多数決", "みんなで決めよう"],
+                'food_location': ["お腹すいた", "腹減った", "何食べる", "どこで食べる", "晩ご飯どうする"],
+                'entertainment': ["暇だ", "退屈", "つまらない", "何かしよう", "やることない"],
+                'gaming': ["ゲームしよう", "ゲームタイム", "何か遊ぼう"],
+                'drinking_games': ["飲みゲーム", "罰ゲーム", "飲もう", "乾杯しよう"],
+                'music': ["音楽かけて", "何か曲かけて", "おすすめの曲", "音楽タイム"],
+                'trivia': ["クイズ", "クイズ出して", "雑学", "頭の体操"],
+                'memes': ["ミーム", "面白い画像", "笑わせて"],
+                'space_adventure': ["宇宙の冒険", "ストーリータイム", "宇宙ミッション"],
+                'roast': ["いじって", "褒めて", "ディスって"]
+            }
+        }
+        
+        # Trigger indexes and the classifier are built lazily (see LAZY INDEXES) and warmed after startup
+        self.passive_stats = Counter()
+        
+        # Optional micro-batching of passive classification for very chatty groups
+        batch_ms = int(os.getenv('PASSIVE_BATCH_MS', '0'))
+        self.passive_batcher = PassiveBatcher(self.process_passive_batch, batch_ms) if batch_ms > 0 else None
+        
         # Enhanced mood system
         self.moods = {
             'normal': {
@@ -459,6 +1703,20 @@ class CrewCaptain:
             }
         ]
 
+        # What each choice leads to: narration, flags picked up, who gets eliminated, scenes skipped
+        self.space_consequences = {
+            'attract_attention': {'text': "⚠️ Your bold approach draws unwanted attention from station security!", 'flags': ['heat']},
+            'stealth_bonus': {'text': "🥷 Smart thinking! Your stealth approach gives the crew an advantage.", 'flags': ['stealth']},
+            'sacrifice_needed': {'text': "💀 Someone needs to take the risk...", 'eliminate': "☠️ **{name}** volunteers and gets captured by security!"},
+            'risky_entry': {'text': "🪪 The fake IDs pass... barely. Security will remember those faces.", 'flags': ['heat']},
+            'safe_passage': {'text': "🎩 Diplomatic immunity! Security waves you straight through.", 'skip': 1},
+            'cargo_inspection': {'text': "📦 The crew hides among the cargo crates. Nobody looks twice.", 'flags': ['stealth']},
+            'pirate_games': {'text': "🏴‍☠️ The pirates roar with approval. Game on!"},
+            'pay_toll': {'text': "💰 One fat toll later, the pirates step aside.", 'skip': 1},
+            'dangerous_route': {'text': "🧊 The back route crosses thin ice...", 'eliminate': "☠️ **{name}** falls through the ice!", 'skip': 1}
+        }
+        self.space_keyboards = OrderedDict()
+
         # Easy Space Trivia Questions
         self.space_trivia = [
             {'question': 'What color is Yoda\'s lightsaber?', 'options': ['Green', 'Blue', 'Red', 'Purple'], 'answer': 'Green'},
@@ -485,64 +1743,327 @@ class CrewCaptain:
             'Use "space lingo" for everything ("stellar drink", "cosmic bathroom")',
         ]
 
-        # Easter eggs hints
-        self.easter_egg_hints = [
-            "🕵️ Try typing 'konami' for a classic surprise...",
-            "🥷 There's a secret ninja command hiding in plain sight...",
-            "🌟 Legend says typing 'legendary' might unlock something special...",
-            "🎮 Gamers might want to try 'up up down down'...",
-            "🌸 Something beautiful happens when you say the magic sakura word..."
+        # Easter eggs: trigger substring -> reveal message, compiled into one pattern below
+        self.easter_eggs = {
+            'konami': "🕹️ **KONAMI CODE ACTIVATED!** 🕹️\nExtra karma for everyone!",
+            'ninja': "🥷 **NINJA MODE UNLOCKED!** 🥷\nStealth payments activated!",
+            'legendary': "🌟 **LEGENDARY STATUS!** 🌟\nYou're now a decision master!",
+            'up up down down': "🎮 **CHEAT CODE ACCEPTED!** 🎮\nInfinite lives granted!",
+            'sakura': "🌸 **SAKURA POWER!** 🌸\nCherry blossom energy activated!"
+        }
+        self.easter_egg_pattern = phrase_pattern(self.easter_eggs)
+        
+        # Easter eggs hints
+        self.easter_egg_hints = [
+            "🕵️ Try typing 'konami' for a classic surprise...",
+            "🥷 There's a secret ninja command hiding in plain sight...",
+            "🌟 Legend says typing 'legendary' might unlock something special...",
+            "🎮 Gamers might want to try 'up up down down'...",
+            "🌸 Something beautiful happens when you say the magic sakura word..."
+        ]
+        
+        # Built-in decisions; chats add their own with /list
+        self.choice_sets = {
+            'choose_food': {
+                'title': 'Food Decision',
+                'options': ['🍕 Pizza', '🍔 Burgers', '🍜 Ramen', '🥘 Russian Food', '🍱 Sushi', '🌮 Tacos', '🍝 Pasta', '🥗 Salad']
+            },
+            'choose_bars': {
+                'title': 'Where to Drink',
+                'options': ['🍺 Local Pub', '🍶 Sake Bar', '🍸 Cocktail Lounge', '🏠 Someone\'s Place', '🌃 Bar District', '🍻 Beer Garden', '🥃 Whiskey Bar']
+            },
+            'choose_entertainment': {
+                'title': 'Entertainment Choice',
+                'options': ['🎬 Movies', '🎤 Karaoke', '🎮 Gaming', '🎲 Board Games', '🃏 Card Games', '🎳 Bowling', '🎯 Darts', '📺 Netflix']
+            },
+            'choose_activities': {
+                'title': 'Activity Decision',
+                'options': ['🚶 Walk Around', '🏔️ Hiking', '🛍️ Shopping', '🎨 Art Gallery', '🎪 Arcade', '🎢 Amusement Park', '🌊 Beach', '🌸 Park']
+            },
+            'choose_random_life': {
+                'title': 'Random Life Decision',
+                'options': ['💤 Sleep More', '💪 Exercise', '📚 Learn Something', '📱 Social Media', '🧹 Clean House', '🍳 Cook', '📞 Call Family', '🎵 Music']
+            },
+            'choose_philosophy': {
+                'title': 'Deep Life Question',
+                'options': ['🤔 What is happiness?', '💭 Why are we here?', '🌟 What matters most?', '⏰ How to spend time?', '💝 What is love?', '🎯 What is success?']
+            }
+        }
+        
+        # Built-in polls: callback -> (question, options, vote type)
+        self.vote_sets = {
+            'vote_food': ("What should we eat?", ["🍕 Pizza", "🍔 Burgers", "🍜 Ramen", "🥘 Russian Food", "🍱 Sushi"], "food"),
+            'vote_bar': ("Where should we drink?", ["🍺 Local Pub", "🍶 Sake Bar", "🍸 Cocktail Lounge", "🏠 Someone's Place", "🌃 Bar Crawl"], "bar"),
+            'vote_activity': ("What should we do?", ["🎮 Gaming Night", "🎬 Movie Night", "🎤 Karaoke", "🎲 Board Games", "🚶 Walk Around"], "activity")
+        }
+        self.vote_topics = [
+            ("Best anime character", ["🥷 Naruto", "⚡ Pikachu", "🗾 Goku", "🌸 Sailor Moon"]),
+            ("Worst Russian stereotype", ["🐻 Bears everywhere", "🍺 Always drunk", "❄️ Always cold", "🪆 Love matryoshkas"]),
+            ("Best superpower", ["🦸 Flying", "👤 Invisibility", "🧠 Mind reading", "⚡ Super speed"]),
+            ("Zombie apocalypse weapon", ["🏏 Baseball bat", "🔫 Shotgun", "🗾 Katana", "🥄 Spoon"])
+        ]
+        
+        # Inline answers by normalized query: (expires, results), least recently used first
+        self.inline_cache = OrderedDict()
+        
+        # Per-chat mood rotation, trivia of the day and Friday reminders, fired by run_schedule
+        self.schedule = ChatSchedule()
+
+    # LAZY INDEXES
+    # Derived from the content above on first use; warm_up() builds them in the background after startup
+    @cached_property
+    def trigger_phrases(self):
+        """All packs compiled into one phrase list per category, so every language shares one matcher pass"""
+        phrases = defaultdict(list)
+        for pack in self.passive_trigger_packs.values():
+            for category, triggers in pack.items():
+                phrases[category].extend(triggers)
+        return phrases
+    
+    @cached_property
+    def trigger_vocabulary(self):
+        """Every token any trigger could match on; messages sharing none skip the matcher"""
+        return frozenset(
+            token for triggers in self.trigger_phrases.values() for trigger in triggers for token in tokenize(trigger)
+        )
+    
+    @cached_property
+    def trigger_spelling(self):
+        return SymSpellIndex(self.trigger_vocabulary)
+    
+    @cached_property
+    def intent_classifier(self):
+        return IntentClassifier(self.trigger_phrases)
+    
+    @cached_property
+    def space_graph(self):
+        return SceneGraph(self.space_episodes, self.space_consequences)
+    
+    @cached_property
+    def space_scene_renders(self):
+        """Scene text and keyboard layouts never change, so render them once per node"""
+        return [self.render_space_scene(node) for node in self.space_graph.nodes]
+    
+    @cached_property
+    def space_episode_catalog(self):
+        return self.render_space_catalog()
+    
+    @cached_property
+    def inline_trivia(self):
+        """Every trivia question as a ready inline result, under 'all' and its lowercase category"""
+        results = defaultdict(list)
+        for index, question in enumerate(self.trivia_questions):
+            options = "\n".join(f"{'ABCD'[i]}) {html.escape(option)}" for i, option in enumerate(question['options']))
+            text = (f"🧠 <b>{html.escape(question['category'])} Trivia</b>\n\n<b>{html.escape(question['question'])}</b>"
+                    f"\n\n{options}\n\n🎯 Answer: <tg-spoiler>{html.escape(question['answer'])}</tg-spoiler>")
+            result = InlineQueryResultArticle(
+                id=f"trivia_{index}", title=question['question'], description=f"🧠 {question['category']}",
+                input_message_content=InputTextMessageContent(text, parse_mode='HTML'))
+            results['all'].append(result)
+            results[question['category'].lower()].append(result)
+        return results
+    
+    @cached_property
+    def inline_help(self):
+        """Shown for an empty or unrecognised inline query"""
+        examples = [
+            ("🎲 pizza or sushi", "Let the bot decide between options", "🎲 Type options separated by *or* or commas and I'll pick one!"),
+            ("🧠 trivia", "Random trivia questions (trivia russian, trivia japanese...)", "🧠 Type *trivia* to quiz any chat!"),
+            ("🔥 roast Alex", "Roast a friend in every mood", "🔥 Type *roast* and a name to serve a roast!"),
         ]
+        return [InlineQueryResultArticle(id=f"help_{i}", title=title, description=description,
+                                         input_message_content=InputTextMessageContent(text, parse_mode='Markdown'))
+                for i, (title, description, text) in enumerate(examples)]
+    
+    async def warm_up(self):
+        """Build the lazy indexes one at a time, yielding to update handling in between"""
+        started = time.perf_counter()
+        for name in WARM_UP_ORDER:
+            try:
+                getattr(self, name)
+            except Exception:
+                logger.exception(f"❌ Warm-up failed building {name}")
+            await asyncio.sleep(0)
+        logger.info(f"🔥 Content warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+    
+    async def post_init(self, application):
+        """Start warming caches without holding up webhook binding or polling"""
+        self.warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
 
-    # FUZZY MATCHING SYSTEM
-    def fuzzy_match(self, trigger_phrase, message_text):
-        """Check if trigger phrase matches message with fuzzy logic"""
-        message_lower = message_text.lower()
-        trigger_lower = trigger_phrase.lower()
-        
-        # Simple substring matching for better natural conversation detection
-        if len(trigger_lower.split()) == 1:
-            # Single word - check word boundaries to avoid partial matches
-            pattern = r'\b' + re.escape(trigger_lower) + r'\b'
-            return bool(re.search(pattern, message_lower))
-        else:
-            # Multi-word phrase - check if most words are present
-            trigger_words = set(trigger_lower.split())
-            message_words = set(message_lower.split())
-            
-            # Allow some flexibility - require at least 70% of words to match
-            matches = len(trigger_words.intersection(message_words))
-            required_matches = max(1, int(len(trigger_words) * 0.7))
-            return matches >= required_matches
+    # STATE SNAPSHOTS
+    def chat_state(self, group):
+        """One chat's state as plain dicts, lists, sets and numbers, ready for marshal"""
+        state = dict(group, version=CHAT_SCHEMA_VERSION)
+        for key, value in group.items():
+            if key in CHAT_OBJECTS:
+                state[key] = value.to_state()
+            elif key in CHAT_COUNTERS:
+                state[key] = dict(value)
+        state['payment_history'] = [dict(entry, time=entry['time'].timestamp()) for entry in group['payment_history']]
+        state['active_votes'] = {
+            vote_id: dict(vote, votes=dict(vote['votes']), created=vote['created'].timestamp())
+            for vote_id, vote in group['active_votes'].items()
+        }
+        state['music_stats'] = dict(group['music_stats'], by_category=dict(group['music_stats']['by_category']))
+        state['meme_stats'] = dict(group['meme_stats'], by_subreddit=dict(group['meme_stats']['by_subreddit']))
+        state['space_adventure'] = dict(group['space_adventure'],
+                                        game_stats=dict(group['space_adventure']['game_stats']))
+        return state
+
+    def chat_from_state(self, state):
+        """Inverse of chat_state, after migrating older saves, on top of a fresh chat so new keys get defaults"""
+        state = migrate_chat(state)
+        group = self.group_data.factory()
+        group.update(state)
+        for key, cls in CHAT_OBJECTS.items():
+            if key in state:
+                group[key] = cls.from_state(state[key])
+        for key in CHAT_COUNTERS:
+            if key in state:
+                group[key] = defaultdict(int, state[key])
+        for entry in group['payment_history']:
+            entry['time'] = datetime.fromtimestamp(entry['time'])
+        for vote in group['active_votes'].values():
+            vote['votes'] = defaultdict(int, vote['votes'])
+            vote['created'] = datetime.fromtimestamp(vote['created'])
+        group['music_stats']['by_category'] = defaultdict(int, group['music_stats']['by_category'])
+        group['meme_stats']['by_subreddit'] = defaultdict(int, group['meme_stats']['by_subreddit'])
+        group['space_adventure']['game_stats'] = defaultdict(int, group['space_adventure']['game_stats'])
+        return group
+
+    def snapshot_chats(self):
+        """Chats never read since the restore are saved back untouched, whatever version they are at"""
+        chats = dict(self.group_data.stored)
+        chats.update((chat_id, self.chat_state(group)) for chat_id, group in self.group_data.items())
+        return chats
+
+    def restore_chats(self, chats):
+        """Keep the saved chats as they are; each one is migrated and loaded on first use"""
+        self.group_data.stored.update(chats)
+
+    def restore_timers(self, job_queue):
+        """Re-arm the vote timers of space rounds that were open when the last run stopped"""
+        if not job_queue:
+            return 0
+        # Chats with an open round are loaded now so their timers find them
+        for chat_id, state in list(self.group_data.stored.items()):
+            if any(session['round'] for session in state['space_adventure']['sessions'].values()):
+                self.group_data[chat_id]
+        
+        now = time.time()
+        restored = 0
+        for chat_id, group in self.group_data.items():
+            for session in group['space_adventure']['sessions'].values():
+                current = session['round']
+                if current and 'deadline' in current:
+                    job_queue.run_once(self.space_round_timeout, max(current['deadline'] - now, 0), chat_id=chat_id,
+                                       data=(session['id'], current['node']),
+                                       name=f"space_round_{chat_id}_{session['id']}")
+                    restored += 1
+        return restored
 
     # PASSIVE LISTENING SYSTEM
     async def check_passive_triggers(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Check for passive triggers in messages with 10-second cooldown"""
+        """Check for passive triggers in messages under the chat's response policy.
+        True if one fired, PASSIVE_DEFERRED if the message went to the batcher, otherwise False."""
         if not update.message or not update.message.text:
             return False
             
         chat_id = update.effective_chat.id
-        text = update.message.text.strip()
+        group = self.group_data[chat_id]
+        policy = group['passive_policy']
+        stats = self.passive_stats
+        stats['messages'] += 1
+        if stats['messages'] % PASSIVE_STATS_LOG_EVERY == 0:
+            self.log_passive_stats()
+        
+        now = time.time()
+        policy.observe(now)
         
         # Check if passive triggers are enabled for this group
-        if not self.group_data[chat_id]['passive_triggers_enabled']:
+        if not group['passive_triggers_enabled']:
+            stats['disabled'] += 1
             return False
         
-        # Cooldown check (10 seconds between passive responses)
-        now = datetime.now()
-        last_response = self.group_data[chat_id]['last_passive_response']
-        if (now - last_response).total_seconds() < 10:
+        # Adaptive cooldown check before touching the text
+        if policy.cooling_down(now):
+            stats['cooldown'] += 1
             return False
         
-        # Check each trigger category
-        for category, triggers in self.passive_triggers.items():
-            for trigger in triggers:
-                if self.fuzzy_match(trigger, text):
-                    self.group_data[chat_id]['last_passive_response'] = now
-                    await self.handle_passive_trigger(update, context, category, trigger)
-                    return True
+        # Pre-filter: one tokenization rejects messages with no trigger vocabulary
+        text = self.trigger_text(update.message.text)
+        if text is None:
+            stats['prefiltered'] += 1
+            return False
         
-        return False
+        stats['matcher_runs'] += 1
+        if self.passive_batcher:
+            # High-volume mode: classified later together with the chat's other recent messages
+            self.passive_batcher.add(chat_id, (update, context, text))
+            return PASSIVE_DEFERRED
+        
+        category, score, trigger = self.intent_classifier.classify(text)
+        return await self.respond_to_intent(update, context, policy, category, score, trigger)
+
+    def trigger_text(self, message_text):
+        """Classifier input for a message, or None if it shares no (typo-corrected) trigger vocabulary"""
+        tokens = tokenize(message_text)
+        corrected = self.trigger_spelling.correct(tokens)
+        if self.trigger_vocabulary.isdisjoint(corrected):
+            return None
+        
+        # Corrections are appended rather than substituted so real words that happen to be
+        # one edit from a trigger word ("mean" -> "meal") keep their original meaning
+        fixes = [fixed for token, fixed in zip(tokens, corrected) if fixed != token]
+        return " ".join(tokens + fixes)
+
+    async def respond_to_intent(self, update, context, policy, category, score, trigger):
+        """Fire a classified passive trigger if the chat's policy allows it"""
+        now = time.time()
+        if score < policy.intent_threshold:
+            return False
+        
+        if not policy.allow(category, now):
+            self.passive_stats['rate_limited'] += 1
+            return False
+        
+        policy.responded(now)
+        self.passive_stats['matched'] += 1
+        await self.handle_passive_trigger(update, context, category, trigger)
+        return True
+
+    async def process_passive_batch(self, chat_id, items):
+        """Classify a chat's buffered messages in one pass and act only on the top trigger"""
+        policy = self.group_data[chat_id]['passive_policy']
+        if policy.cooling_down(time.time()):
+            self.passive_stats['cooldown'] += len(items)
+            return
+        
+        results = self.intent_classifier.classify_batch([text for _, _, text in items])
+        candidates = sorted(
+            (PASSIVE_PRIORITY.index(category), -score, i)
+            for i, (category, score, _) in enumerate(results)
+            if score >= policy.intent_threshold
+        )
+        
+        for _, _, i in candidates:
+            update, context, _ = items[i]
+            if await self.respond_to_intent(update, context, policy, *results[i]):
+                return
+
+    def log_passive_stats(self):
+        """Log how many messages were short-circuited before the trigger matcher"""
+        stats = self.passive_stats
+        total = max(1, stats['messages'])
+        skipped = stats['disabled'] + stats['cooldown'] + stats['prefiltered']
+        logger.info(
+            f"🎧 Passive filter: {skipped / total:.1%} of {total} messages short-circuited "
+            f"(cooldown {stats['cooldown']}, pre-filter {stats['prefiltered']}, disabled {stats['disabled']}), "
+            f"matcher ran {stats['matcher_runs']}x, fired {stats['matched']}x, rate-limited {stats['rate_limited']}x"
+        )
+        if self.passive_batcher and self.passive_batcher.batches:
+            batcher = self.passive_batcher
+            logger.info(f"🎧 Passive batching: {batcher.messages / batcher.batches:.1f} messages per batch")
 
     async def handle_passive_trigger(self, update: Update, context: ContextTypes.DEFAULT_TYPE, category: str, trigger: str):
         """Handle specific passive trigger categories"""
@@ -689,7 +2210,34 @@ class CrewCaptain:
                 ])
             )
 
-    async def passive_who_pays(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    def pick_payer(self, chat_id, members, amount=None):
+        """Choose who pays through the fairness engine and add it to the audit trail"""
+        group = self.group_data[chat_id]
+        fairness = group['payment_fairness']
+        
+        chosen = fairness.choose(members, group['karma'])
+        entry = fairness.record_payment(chosen.id, group['karma'], amount)
+        group['karma'][chosen.id] += 1
+        
+        history = group['payment_history']
+        history.append(entry)
+        if len(history) > PAYMENT_HISTORY_LIMIT:
+            del history[:-PAYMENT_HISTORY_LIMIT]
+        return chosen
+
+    async def who_pays_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/whopays [amount] - pick a payer and optionally put the bill on the tab"""
+        cents = None
+        if context.args:
+            cents = parse_amount(context.args[0])
+            if cents is None:
+                await update.message.reply_text("💸 Usage: /whopays [amount], e.g. /whopays 42.50")
+                return
+        
+        self.group_data[update.effective_chat.id]['active_members'].touch(update.effective_user)
+        await self.passive_who_pays(update, context, cents)
+
+    async def passive_who_pays(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cents=None):
         """Handle passive payment triggers"""
         chat_id = update.effective_chat.id
         
@@ -701,10 +2249,12 @@ class CrewCaptain:
             )
             return
         
-        chosen = random.choice(members)
-        self.group_data[chat_id]['karma'][chosen.id] += 1
+        chosen = self.pick_payer(chat_id, members, cents / 100 if cents else None)
+        if cents:
+            # The chosen payer covers everyone present, so the bill goes on the shared tab
+            self.group_data[chat_id]['ledger'].add_expense(chosen.id, cents, [m.id for m in members], "who pays")
         
-        display_name = self.group_data[chat_id]['nicknames'].get(chosen.id, chosen.first_name)
+        display_name = chosen.first_name
         mood = self.group_data[chat_id]['mood']
         message = random.choice(self.moods[mood]['messages'])
         
@@ -717,6 +2267,8 @@ class CrewCaptain:
         }
         
         response = mood_responses.get(mood, f"💸 {message}\n\n**{display_name}** pays!")
+        if cents:
+            response += f"\n\n🧾 Bill of {format_cents(cents)} added to the tab. /balance to check it."
         
         await update.message.reply_text(
             response,
@@ -727,6 +2279,131 @@ class CrewCaptain:
             parse_mode='Markdown'
         )
 
+    # BILL SPLITTING LEDGER
+    def display_name(self, chat_id, user_id):
+        """Best known name for a user in this chat, already Markdown-escaped"""
+        return self.group_data[chat_id]['names'].get(user_id)
+
+    def expense_participants(self, update: Update, chat_id):
+        """Explicitly mentioned users, otherwise everyone present; the payer always shares.
+        Also returns the @usernames that could not be matched to anyone seen in the chat."""
+        payer_id = update.effective_user.id
+        directory = self.group_data[chat_id]['names']
+        mentioned, unknown = [], []
+        for entity in update.message.entities or []:
+            if entity.type == 'text_mention' and entity.user:
+                mentioned.append(entity.user.id)
+            elif entity.type == 'mention':
+                username = update.message.parse_entity(entity)
+                user_id = directory.resolve(username)
+                if user_id is None:
+                    unknown.append(username)
+                else:
+                    mentioned.append(user_id)
+        if mentioned or unknown:
+            return [payer_id] + mentioned, unknown
+        
+        present = self.group_data[chat_id]['active_members'].recent(ACTIVE_MEMBER_HOURS)
+        return [payer_id] + present, unknown
+
+    async def spent_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/spent <amount> [description] - record an expense you paid for the group"""
+        chat_id = update.effective_chat.id
+        user = update.effective_user
+        self.group_data[chat_id]['active_members'].touch(user)
+        
+        cents = parse_amount(context.args[0]) if context.args else None
+        if cents is None:
+            await update.message.reply_text(
+                "🧾 Usage: /spent <amount> [description]\n"
+                "Splits evenly between everyone active, or only the people you mention."
+            )
+            return
+        
+        participants, unknown = self.expense_participants(update, chat_id)
+        if unknown:
+            await update.message.reply_text(
+                f"🧾 I don't know {', '.join(unknown)} yet. They need to say something here first."
+            )
+            return
+        # Mentions say who shares, they are not part of the description
+        description = " ".join(arg for arg in context.args[1:] if not arg.startswith('@'))[:60]
+        ledger = self.group_data[chat_id]['ledger']
+        ledger.add_expense(user.id, cents, participants, description)
+        
+        share = cents / len(set(participants)) / 100
+        what = f" for *{escape_markdown(description, version=1)}*" if description else ""
+        await update.message.reply_text(
+            f"🧾 {self.display_name(chat_id, user.id)} paid **{format_cents(cents)}**{what}\n"
+            f"👥 Split {len(set(participants))} ways ({share:.2f} each)\n\n"
+            f"Your balance: {format_cents(ledger.balance(user.id))}",
+            parse_mode='Markdown'
+        )
+
+    def render_balances(self, chat_id):
+        """Net balances plus the suggested settle-up transfers"""
+        ledger = self.group_data[chat_id]['ledger']
+        owed = sorted(((amount, user_id) for user_id, amount in ledger.balances.items() if amount),
+                      reverse=True)
+        
+        if not owed:
+            return "💰 **The Tab** 💰\n\nEveryone is square! 🎉", None
+        
+        text = "💰 **The Tab** 💰\n\n"
+        names = self.group_data[chat_id]['names'].names(user_id for _, user_id in owed)
+        for (amount, user_id), name in zip(owed, names):
+            icon = "🟢" if amount > 0 else "🔴"
+            text += f"{icon} {name}: {'+' if amount > 0 else ''}{format_cents(amount)}\n"
+        
+        text += "\n🤝 **Settle up:**\n"
+        for from_id, to_id, cents in ledger.settle_up():
+            text += f"• {self.display_name(chat_id, from_id)} → {self.display_name(chat_id, to_id)}: {format_cents(cents)}\n"
+        
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("✅ Mark All Settled", callback_data="ledger_settle_all")]])
+        return text, keyboard
+
+    async def balance_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/balance and /settle - show who owes what and how to square up"""
+        text, keyboard = self.render_balances(update.effective_chat.id)
+        await update.message.reply_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+    async def ledger_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle ledger buttons"""
+        query = update.callback_query
+        chat_id = update.effective_chat.id
+        
+        if query.data == "ledger_settle_all":
+            keyboard = InlineKeyboardMarkup([
+                [InlineKeyboardButton("✅ Yes, clear the tab", callback_data="ledger_settle_confirm")],
+                [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+            ])
+            await query.edit_message_text("⚠️ Mark every balance as paid? This clears the whole tab.\n"
+                                          "Only a chat admin can confirm.", reply_markup=keyboard)
+        
+        elif query.data == "ledger_settle_confirm":
+            if not await self.is_chat_admin(context, update.effective_chat, update.effective_user.id):
+                await query.answer("Only a chat admin can clear the tab.", show_alert=True)
+                return
+            await query.answer()
+            ledger = self.group_data[chat_id]['ledger']
+            transfers = ledger.settle_up()
+            for from_id, to_id, cents in transfers:
+                ledger.record_transfer(from_id, to_id, cents)
+            
+            await query.edit_message_text(
+                f"✅ Tab cleared with {len(transfers)} transfer{'s' if len(transfers) != 1 else ''}!",
+                reply_markup=self.get_back_keyboard()
+            )
+
+    async def is_chat_admin(self, context: ContextTypes.DEFAULT_TYPE, chat, user_id):
+        if chat.type == 'private':
+            return True
+        try:
+            member = await context.bot.get_chat_member(chat.id, user_id)
+        except TelegramError:
+            return False
+        return member.status in ('administrator', 'creator')
+
     def get_main_menu_keyboard(self, chat_id):
         """Enhanced main menu with all features"""
         mood_emoji = self.moods[self.group_data[chat_id]['mood']]['emoji']
@@ -772,13 +2449,15 @@ class CrewCaptain:
         """Welcome message with main menu"""
         chat_id = update.effective_chat.id
         
-        # Track active member
-        if update.effective_user:
-            self.group_data[chat_id]['active_members'].add(update.effective_user.id)
+        # Track active member (callbacks are already tracked in handle_callback)
+        if update.message:
+            self.group_data[chat_id]['active_members'].touch(update.effective_user)
         
-        # Auto-rotate mood if enabled
-        if self.group_data[chat_id]['mood_auto_rotate']:
+        # Auto-rotate mood if enabled; from then on the daily timer keeps it current
+        if self.group_data[chat_id]['mood_auto_rotate'] and (chat_id, 'mood') not in self.schedule.due:
             await self.maybe_auto_rotate_mood(chat_id)
+            if context.job_queue:
+                self.schedule.add(chat_id, 'mood', next_run('mood', chat_id, time.time()))
         
         # Show easter egg hint occasionally
         hint_text = ""
@@ -810,13 +2489,80 @@ Let's do something ⬇️{hint_text}
         if not self.group_data[chat_id]['mood_auto_rotate']:
             return
             
-        day_moods = ['cyberpunk', 'pokemon', 'starwars', 'anime', 'gaming', 'dramatic', 'pirate']
-        day_of_week = datetime.now().weekday()
-        new_mood = day_moods[day_of_week % len(day_moods)]
+        new_mood = DAY_MOODS[datetime.now().weekday() % len(DAY_MOODS)]
         
         if self.group_data[chat_id]['mood'] != new_mood:
             self.group_data[chat_id]['mood'] = new_mood
 
+    # SCHEDULED EVENTS
+    async def run_schedule(self, context: ContextTypes.DEFAULT_TYPE):
+        """Job queue tick: fire every per-chat timer that has come due and arm its next occurrence"""
+        now = time.time()
+        actions = {'mood': self.scheduled_mood, 'trivia': self.scheduled_trivia, 'payday': self.scheduled_payday}
+        
+        for fired, (chat_id, event, when) in enumerate(self.schedule.pop_due(now), 1):
+            # Re-armed first, so a failed send does not lose the chat's schedule
+            self.schedule.add(chat_id, event, next_run(event, chat_id, now))
+            try:
+                if event == 'mood' or now - when <= SCHEDULE_GRACE_SECONDS:
+                    await actions[event](context.bot, chat_id)
+            except Forbidden:
+                # Removed from the chat: nobody left to remind
+                for other in SCHEDULE_TIMES:
+                    self.schedule.cancel(chat_id, other)
+            except TelegramError as e:
+                logger.warning(f"⚠️ Scheduled {event} for chat {chat_id} failed: {e}")
+            if fired % 100 == 0:
+                await asyncio.sleep(0)  # let updates through during a big batch
+
+    async def scheduled_mood(self, bot, chat_id):
+        """Silent: the new mood shows in the next reply"""
+        await self.maybe_auto_rotate_mood(chat_id)
+
+    async def scheduled_trivia(self, bot, chat_id):
+        question = random.choice(self.inline_trivia['all']).input_message_content.message_text
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🧠 More Trivia", callback_data="trivia_menu")]])
+        await bot.send_message(chat_id, f"📅 <b>Trivia of the day</b>\n\n{question}", reply_markup=keyboard,
+                               parse_mode='HTML')
+
+    async def scheduled_payday(self, bot, chat_id):
+        """Friday evening: the open tab if there is one, otherwise a nudge to pick who pays"""
+        text, keyboard = self.render_balances(chat_id)
+        if keyboard is None:
+            text = "🍻 **It's Friday!** 🍻\n\nPlans tonight? Someone has to pay..."
+            keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💸 Who Pays?", callback_data="who_pays")]])
+        await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='Markdown')
+
+    def set_scheduled(self, chat_id, event, enabled):
+        if event == 'mood':
+            self.group_data[chat_id]['mood_auto_rotate'] = enabled
+        if enabled:
+            self.schedule.add(chat_id, event, next_run(event, chat_id, time.time()))
+        else:
+            self.schedule.cancel(chat_id, event)
+
+    async def schedule_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/schedule [mood|trivia|payday on|off] - show or change this chat's timed events"""
+        chat_id = update.effective_chat.id
+        labels = {'mood': "🎭 Daily mood rotation", 'trivia': "🧠 Trivia of the day", 'payday': "🍻 Friday who's paying"}
+        
+        if not context.job_queue:
+            await update.message.reply_text("⏰ Scheduling needs the job queue (pip install \"python-telegram-bot[job-queue]\").")
+            return
+        
+        if len(context.args) == 2 and context.args[0].lower() in labels and context.args[1].lower() in ('on', 'off'):
+            self.set_scheduled(chat_id, context.args[0].lower(), context.args[1].lower() == 'on')
+        elif context.args:
+            await update.message.reply_text("⏰ Usage: /schedule [mood|trivia|payday] [on|off]")
+            return
+        
+        text = "⏰ **Scheduled Events** ⏰\n\n"
+        for event, label in labels.items():
+            when = self.schedule.due.get((chat_id, event))
+            status = f"next {datetime.fromtimestamp(when):%a %H:%M}" if when else "off"
+            text += f"{label}: {status}\n"
+        await update.message.reply_text(text, parse_mode='Markdown')
+
     # YOUTUBE MUSIC FEATURE
     async def get_random_youtube_music(self, category='random'):
         """Get random music from YouTube API"""
@@ -962,54 +2708,46 @@ Let's do something ⬇️{hint_text}
             return None
 
     async def get_group_members(self, context: ContextTypes.DEFAULT_TYPE, chat_id):
-        """Get actual group members"""
-        try:
-            if chat_id > 0:
-                return []
-            
-            admins = await context.bot.get_chat_administrators(chat_id)
-            members = []
-            
-            for admin in admins:
-                if not admin.user.is_bot and admin.user.id != context.bot.id:
-                    members.append(admin.user)
-            
-            for user_id in self.group_data[chat_id]['active_members']:
-                try:
-                    member = await context.bot.get_chat_member(chat_id, user_id)
-                    if (member.status not in ['left', 'kicked'] and 
-                        not member.user.is_bot and 
-                        member.user not in members):
-                        members.append(member.user)
-                except:
-                    continue
-                    
-            return members
-            
-        except Exception as e:
-            logger.error(f"Error getting group members: {e}")
-            members = []
-            for user_id in self.group_data[chat_id]['active_members']:
-                class MockUser:
-                    def __init__(self, user_id, nicknames):
-                        self.id = user_id
-                        self.first_name = nicknames.get(user_id, f"User {user_id}")
-                        self.is_bot = False
-                members.append(MockUser(user_id, self.group_data[chat_id]['nicknames']))
-            return members
+        """Get members recently active in the group, straight from the activity index"""
+        if chat_id > 0:
+            return []
+        
+        member_ids = self.group_data[chat_id]['active_members'].recent(ACTIVE_MEMBER_HOURS)
+        names = self.group_data[chat_id]['names'].names(member_ids)
+        return [ActiveMember(user_id, name) for user_id, name in zip(member_ids, names)]
+    
+    async def record_names(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Runs before every handler: keep the chat's name directory current"""
+        chat = update.effective_chat
+        if chat is None:
+            return
+        directory = self.group_data[chat.id]['names']
+        directory.record(update.effective_user)
+        message = update.effective_message
+        if message:
+            for member in message.new_chat_members or ():
+                directory.record(member)
+
+    async def handle_member_left(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Drop members who leave or get removed from the activity index"""
+        left = update.message.left_chat_member if update.message else None
+        if left:
+            self.group_data[update.effective_chat.id]['active_members'].forget(left.id)
 
     # ALL MAIN HANDLERS
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle all button callbacks"""
         query = update.callback_query
-        await query.answer()
+        data = query.data
+        
+        # Vote buttons answer with their own toast; a query can only be answered once
+        if not data.startswith(SELF_ANSWERING_CALLBACKS):
+            await query.answer()
         
         chat_id = update.effective_chat.id
         user = update.effective_user
-        data = query.data
         
-        if user:
-            self.group_data[chat_id]['active_members'].add(user.id)
+        self.group_data[chat_id]['active_members'].touch(user)
 
         # Direct handlers
         direct_handlers = {
@@ -1027,7 +2765,8 @@ Let's do something ⬇️{hint_text}
             "roast_menu": self.roast_menu_handler,
             "space_menu": self.space_menu_handler,
             "games_menu": self.games_menu_handler,
-            "stats_menu": self.stats_menu_handler
+            "stats_menu": self.stats_menu_handler,
+            "passive_menu": self.passive_menu_handler
         }
         
         # Check direct handlers first
@@ -1054,6 +2793,10 @@ Let's do something ⬇️{hint_text}
             await self.choose_option_handler(update, context)
         elif data.startswith("space_"):
             await self.space_handler(update, context)
+        elif data.startswith("passive_"):
+            await self.passive_settings_handler(update, context)
+        elif data.startswith("ledger_"):
+            await self.ledger_handler(update, context)
         else:
             logger.warning(f"Unhandled callback: {data}")
 
@@ -1068,10 +2811,9 @@ Let's do something ⬇️{hint_text}
             await query.edit_message_text("❌ Need at least 2 people!", reply_markup=self.get_back_keyboard())
             return
         
-        chosen = random.choice(members)
-        self.group_data[chat_id]['karma'][chosen.id] += 1
+        chosen = self.pick_payer(chat_id, members)
         
-        display_name = self.group_data[chat_id]['nicknames'].get(chosen.id, chosen.first_name)
+        display_name = chosen.first_name
         mood = self.group_data[chat_id]['mood']
         message = random.choice(self.moods[mood]['messages'])
         
@@ -1104,6 +2846,7 @@ Let democracy decide your fate!{active_text}
                 InlineKeyboardButton("📊 Results", callback_data="vote_results"),
                 InlineKeyboardButton("🗑️ Clear Votes", callback_data="vote_clear")
             ],
+            *self.choice_list_buttons(chat_id, "vote_list_"),
             [
                 InlineKeyboardButton("🔙 Back", callback_data="main_menu")
             ]
@@ -1118,28 +2861,23 @@ Let democracy decide your fate!{active_text}
         user = update.effective_user
         data = query.data
         
-        if data == "vote_food":
-            options = ["🍕 Pizza", "🍔 Burgers", "🍜 Ramen", "🥘 Russian Food", "🍱 Sushi"]
-            await self.create_vote(query, "What should we eat?", options, "food")
-            
-        elif data == "vote_bar":
-            options = ["🍺 Local Pub", "🍶 Sake Bar", "🍸 Cocktail Lounge", "🏠 Someone's Place", "🌃 Bar Crawl"]
-            await self.create_vote(query, "Where should we drink?", options, "bar")
-            
-        elif data == "vote_activity":
-            options = ["🎮 Gaming Night", "🎬 Movie Night", "🎤 Karaoke", "🎲 Board Games", "🚶 Walk Around"]
-            await self.create_vote(query, "What should we do?", options, "activity")
+        if data in self.vote_sets:
+            question, options, vote_type = self.vote_sets[data]
+            await self.create_vote(query, question, options, vote_type)
             
         elif data == "vote_random":
-            topics = [
-                ("Best anime character", ["🥷 Naruto", "⚡ Pikachu", "🗾 Goku", "🌸 Sailor Moon"]),
-                ("Worst Russian stereotype", ["🐻 Bears everywhere", "🍺 Always drunk", "❄️ Always cold", "🪆 Love matryoshkas"]),
-                ("Best superpower", ["🦸 Flying", "👤 Invisibility", "🧠 Mind reading", "⚡ Super speed"]),
-                ("Zombie apocalypse weapon", ["🏏 Baseball bat", "🔫 Shotgun", "🗾 Katana", "🥄 Spoon"])
-            ]
-            topic, options = random.choice(topics)
+            topic, options = random.choice(self.vote_topics)
             await self.create_vote(query, topic, options, "random")
             
+        elif data.startswith("vote_list_"):
+            name = data[len("vote_list_"):]
+            choices = self.group_data[chat_id]['choice_lists'].get(name)
+            if not choices or len(choices.options) < 2:
+                await query.edit_message_text(f"📋 The list '{name}' is gone or too short to vote on.",
+                                              reply_markup=self.get_back_keyboard("vote_menu"))
+                return
+            await self.create_vote(query, choices.title, list(choices.options), f"list_{name}")
+            
         elif data.startswith("vote_option_"):
             await self.handle_vote_option(query, user, data)
             
@@ -1152,28 +2890,26 @@ Let democracy decide your fate!{active_text}
 
     async def create_vote(self, query, question, options, vote_type):
         """Create a new vote"""
-        chat_id = query.message.chat_id
-        
-        vote_id = f"{vote_type}_{int(datetime.now().timestamp())}"
+        vote_id = self.new_vote(query.message.chat_id, question, options, vote_type)
+        text, keyboard = self.render_vote(vote_id, self.group_data[query.message.chat_id]['active_votes'][vote_id])
+        await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+    def new_vote(self, chat_id, question, options, vote_type):
+        active_votes = self.group_data[chat_id]['active_votes']
+        # /poll can open several in the same second; each needs its own id
+        stamp = int(datetime.now().timestamp())
+        while f"{vote_type}_{stamp}" in active_votes:
+            stamp += 1
+        vote_id = f"{vote_type}_{stamp}"
         
-        self.group_data[chat_id]['active_votes'][vote_id] = {
+        active_votes[vote_id] = {
             'question': question,
             'options': options,
             'votes': defaultdict(int),
             'voters': set(),
             'created': datetime.now()
         }
-        
-        text = f"🗳️ **{question}**\n\nClick to vote:"
-        
-        keyboard = []
-        for i, option in enumerate(options):
-            keyboard.append([InlineKeyboardButton(option, callback_data=f"vote_option_{vote_id}_{i}")])
-        
-        keyboard.append([InlineKeyboardButton("📊 Results", callback_data="vote_results")])
-        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="vote_menu")])
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        return vote_id
 
     async def handle_vote_option(self, query, user, data):
         """Handle individual vote"""
@@ -1205,7 +2941,12 @@ Let democracy decide your fate!{active_text}
 
     async def update_vote_display(self, query, vote_id, vote_data):
         """Update vote display with current results"""
-        question = vote_data['question']
+        text, keyboard = self.render_vote(vote_id, vote_data)
+        await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+    def render_vote(self, vote_id, vote_data):
+        """Poll text with the running tally, plus one button per option"""
+        question = escape_markdown(vote_data['question'], version=1)
         total_votes = sum(vote_data['votes'].values())
         
         text = f"🗳️ **{question}**\n\n"
@@ -1216,7 +2957,7 @@ Let democracy decide your fate!{active_text}
                 votes = vote_data['votes'][i]
                 percentage = (votes / total_votes * 100) if total_votes > 0 else 0
                 bar = "█" * min(10, int(percentage / 10))
-                text += f"{option}: {votes} ({percentage:.0f}%)\n{bar}\n"
+                text += f"{escape_markdown(option, version=1)}: {votes} ({percentage:.0f}%)\n{bar}\n"
             
             text += f"\n👥 Total votes: {total_votes}"
         else:
@@ -1229,7 +2970,7 @@ Let democracy decide your fate!{active_text}
         keyboard.append([InlineKeyboardButton("📊 Results", callback_data="vote_results")])
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="vote_menu")])
         
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        return text, InlineKeyboardMarkup(keyboard)
 
     async def show_vote_results(self, query, chat_id):
         """Show all vote results"""
@@ -1241,7 +2982,7 @@ Let democracy decide your fate!{active_text}
             text = "📊 **All Vote Results**\n\n"
             
             for vote_id, vote_data in active_votes.items():
-                question = vote_data['question']
+                question = escape_markdown(vote_data['question'], version=1)
                 total_votes = sum(vote_data['votes'].values())
                 
                 text += f"🗳️ **{question}**\n"
@@ -1249,7 +2990,8 @@ Let democracy decide your fate!{active_text}
                 if total_votes > 0:
                     # Find winner
                     max_votes = max(vote_data['votes'].values()) if vote_data['votes'] else 0
-                    winners = [vote_data['options'][i] for i, votes in vote_data['votes'].items() if votes == max_votes]
+                    winners = [escape_markdown(vote_data['options'][i], version=1)
+                               for i, votes in vote_data['votes'].items() if votes == max_votes]
                     
                     if len(winners) == 1:
                         text += f"🏆 Winner: {winners[0]} ({max_votes} votes)\n"
@@ -1437,6 +3179,7 @@ Can't decide? Let me choose for you!
                 InlineKeyboardButton("🎲 Random Life", callback_data="choose_random_life"),
                 InlineKeyboardButton("💭 Deep Thoughts", callback_data="choose_philosophy")
             ],
+            *self.choice_list_buttons(update.effective_chat.id, "choose_list_"),
             [
                 InlineKeyboardButton("🔙 Back", callback_data="main_menu")
             ]
@@ -1445,78 +3188,251 @@ Can't decide? Let me choose for you!
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
     async def choose_option_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle choosing between predefined options"""
+        """Handle choosing from the built-in option sets and the chat's own lists"""
         query = update.callback_query
         chat_id = update.effective_chat.id
         data = query.data
         mood = self.group_data[chat_id]['mood']
         
-        option_sets = {
-            'choose_food': {
-                'title': 'Food Decision',
-                'options': ['🍕 Pizza', '🍔 Burgers', '🍜 Ramen', '🥘 Russian Food', '🍱 Sushi', '🌮 Tacos', '🍝 Pasta', '🥗 Salad']
-            },
-            'choose_bars': {
-                'title': 'Where to Drink',
-                'options': ['🍺 Local Pub', '🍶 Sake Bar', '🍸 Cocktail Lounge', '🏠 Someone\'s Place', '🌃 Bar District', '🍻 Beer Garden', '🥃 Whiskey Bar']
-            },
-            'choose_entertainment': {
-                'title': 'Entertainment Choice',
-                'options': ['🎬 Movies', '🎤 Karaoke', '🎮 Gaming', '🎲 Board Games', '🃏 Card Games', '🎳 Bowling', '🎯 Darts', '📺 Netflix']
-            },
-            'choose_activities': {
-                'title': 'Activity Decision',
-                'options': ['🚶 Walk Around', '🏔️ Hiking', '🛍️ Shopping', '🎨 Art Gallery', '🎪 Arcade', '🎢 Amusement Park', '🌊 Beach', '🌸 Park']
-            },
-            'choose_random_life': {
-                'title': 'Random Life Decision',
-                'options': ['💤 Sleep More', '💪 Exercise', '📚 Learn Something', '📱 Social Media', '🧹 Clean House', '🍳 Cook', '📞 Call Family', '🎵 Music']
-            },
-            'choose_philosophy': {
-                'title': 'Deep Life Question',
-                'options': ['🤔 What is happiness?', '💭 Why are we here?', '🌟 What matters most?', '⏰ How to spend time?', '💝 What is love?', '🎯 What is success?']
-            }
+        if data in self.choice_sets:
+            option_set = self.choice_sets[data]
+            chosen = random.choice(option_set['options'])
+            response = self.render_choice(mood, option_set['title'], chosen)
+        elif data.startswith("choose_list_"):
+            choices = self.group_data[chat_id]['choice_lists'].get(data[len("choose_list_"):])
+            if not choices or not choices.options:
+                await query.edit_message_text("📋 That list is gone or empty. See /list.",
+                                              reply_markup=self.get_back_keyboard("choose_menu"))
+                return
+            response = self.render_choice(mood, choices.title, choices.pick())
+        else:
+            return
+        
+        keyboard = [
+            [InlineKeyboardButton("🎲 Choose Again", callback_data=data)],
+            [InlineKeyboardButton("🔙 Back", callback_data="choose_menu")]
+        ]
+        
+        await self.suspense_reveal(query, response, InlineKeyboardMarkup(keyboard))
+
+    def render_choice(self, mood, title, chosen):
+        """The decision reveal, in the chat's mood"""
+        # Options are stored as typed and only escaped here, when they go into Markdown
+        title, chosen = escape_markdown(title, version=1), escape_markdown(chosen, version=1)
+        mood_responses = {
+            'pirate': f"🏴‍☠️ By the seven seas, ye should choose: **{chosen}**!",
+            'sarcastic': f"😏 Oh wow, such a *difficult* choice... obviously **{chosen}**!",
+            'anime': f"🎌 Senpai! The anime gods have chosen: **{chosen}**!",
+            'cyberpunk': f"🌃 Neural networks computed optimal choice: **{chosen}**!",
+            'pokemon': f"⚡ Wild choice appeared! It's **{chosen}**!",
+            'dramatic': f"🎭 After EPIC consideration... the choice is **{chosen}**!",
         }
+        return mood_responses.get(mood, f"🎯 **{title}**\n\nI choose: **{chosen}**!")
+
+    # QUICK DECISIONS
+    # One command, one reply: no menu to open and no suspense edits
+    async def choose_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/choose pizza, sushi, ramen - pick one right away"""
+        text = " ".join(context.args)
+        options = list(dict.fromkeys(option[:40] for option in INLINE_CHOICE_SPLIT.split(text) if option))
+        if len(options) < 2:
+            await update.message.reply_text("🎯 Usage: /choose pizza, sushi, ramen\n(or: pizza or sushi)")
+            return
         
-        if data in option_sets:
-            option_set = option_sets[data]
-            chosen = random.choice(option_set['options'])
-            
-            mood_responses = {
-                'pirate': f"🏴‍☠️ By the seven seas, ye should choose: **{chosen}**!",
-                'sarcastic': f"😏 Oh wow, such a *difficult* choice... obviously **{chosen}**!",
-                'anime': f"🎌 Senpai! The anime gods have chosen: **{chosen}**!",
-                'cyberpunk': f"🌃 Neural networks computed optimal choice: **{chosen}**!",
-                'pokemon': f"⚡ Wild choice appeared! It's **{chosen}**!",
-                'dramatic': f"🎭 After EPIC consideration... the choice is **{chosen}**!",
-            }
-            
-            response = mood_responses.get(mood, f"🎯 **{option_set['title']}**\n\nI choose: **{chosen}**!")
-            
-            keyboard = [
-                [InlineKeyboardButton("🎲 Choose Again", callback_data=data)],
-                [InlineKeyboardButton("🔙 Back", callback_data="choose_menu")]
-            ]
-            
-            await self.suspense_reveal(query, response, InlineKeyboardMarkup(keyboard))
+        mood = self.group_data[update.effective_chat.id]['mood']
+        await update.message.reply_text(self.render_choice(mood, "Decision", random.choice(options)),
+                                        parse_mode='Markdown')
+
+    async def poll_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/poll question | option | option - a group vote posted in one message"""
+        question, *options = (part.strip() for part in " ".join(context.args).split('|'))
+        options = list(dict.fromkeys(option[:40] for option in options if option))[:CHOICE_OPTION_LIMIT]
+        if not question or len(options) < 2:
+            await update.message.reply_text("🗳️ Usage: /poll Where to? | Pub | Karaoke | Home")
+            return
+        
+        chat_id = update.effective_chat.id
+        vote_id = self.new_vote(chat_id, question[:100], options, "poll")
+        text, keyboard = self.render_vote(vote_id, self.group_data[chat_id]['active_votes'][vote_id])
+        await update.message.reply_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+    # CUSTOM CHOICE LISTS
+    def choice_list_buttons(self, chat_id, prefix):
+        """Keyboard rows with one button per custom list, two to a row"""
+        buttons = [InlineKeyboardButton(f"📋 {choices.title}", callback_data=prefix + name)
+                   for name, choices in self.group_data[chat_id]['choice_lists'].items()]
+        return [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    def render_choice_list(self, name, choices):
+        options = ", ".join(
+            escape_markdown(option, version=1) + (f" ×{weight:g}" if weight != 1 else "")
+            for option, weight in zip(choices.options, choices.weights)
+        ) or "_(empty)_"
+        title = escape_markdown(choices.title, version=1)
+        return f"📋 **{title}** (`{name}`, cooldown {choices.recent.maxlen})\n{options}"
+
+    async def list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/list [add|remove|delete|cooldown] <name> ... - manage the chat's own choice lists"""
+        chat_id = update.effective_chat.id
+        lists = self.group_data[chat_id]['choice_lists']
+        usage = (
+            "📋 Usage:\n"
+            "/list - show this chat's lists\n"
+            "/list add <name> <option[:weight]>, ... - create a list or add options\n"
+            "/list remove <name> <option>, ... - drop options\n"
+            "/list delete <name> - drop the whole list\n"
+            "/list cooldown <name> <n> - never repeat the last n picks\n"
+            "/pick <name> - let me choose"
+        )
+        
+        if not context.args:
+            if not lists:
+                await update.message.reply_text(usage)
+                return
+            await update.message.reply_text(
+                "\n\n".join(self.render_choice_list(name, choices) for name, choices in lists.items()),
+                parse_mode='Markdown'
+            )
+            return
+        
+        action = context.args[0].lower()
+        name = context.args[1].lower() if len(context.args) > 1 else ''
+        rest = " ".join(context.args[2:])
+        valid_name = CHOICE_NAME.fullmatch(name) and len(name.encode()) <= CHOICE_NAME_BYTES
+        if action not in ('add', 'remove', 'delete', 'cooldown') or not valid_name:
+            await update.message.reply_text(usage)
+            return
+        
+        if action == 'add':
+            options = parse_weighted(rest)
+            if not options:
+                await update.message.reply_text("📋 Give me some options, e.g. /list add bars Pub:3, Sake Bar, Rooftop")
+                return
+            if name not in lists:
+                if len(lists) >= CHOICE_LIST_LIMIT:
+                    await update.message.reply_text(f"📋 This chat already has {CHOICE_LIST_LIMIT} lists. Delete one first.")
+                    return
+                lists[name] = ChoiceList(name.replace('_', ' ').capitalize())
+            choices = lists[name]
+            for option, weight in options:
+                if option in choices.options or len(choices.options) < CHOICE_OPTION_LIMIT:
+                    choices.set(option, weight)
+        
+        elif name not in lists:
+            await update.message.reply_text(f"📋 No list called '{name}'. See /list.")
+            return
+        
+        elif action == 'remove':
+            choices = lists[name]
+            for option, _ in parse_weighted(rest):
+                choices.remove(option)
+        
+        elif action == 'delete':
+            del lists[name]
+            await update.message.reply_text(f"🗑️ List '{name}' deleted.")
+            return
+        
+        else:
+            try:
+                picks = int(rest)
+            except ValueError:
+                await update.message.reply_text(usage)
+                return
+            choices = lists[name]
+            choices.set_cooldown(max(0, min(picks, CHOICE_OPTION_LIMIT)))
+        
+        await update.message.reply_text(self.render_choice_list(name, choices), parse_mode='Markdown')
+
+    async def pick_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/pick <name> - weighted choice from one of the chat's lists"""
+        chat_id = update.effective_chat.id
+        lists = self.group_data[chat_id]['choice_lists']
+        choices = lists.get(context.args[0].lower()) if context.args else None
+        if not choices or not choices.options:
+            names = ", ".join(lists) or "none yet"
+            await update.message.reply_text(f"🎯 Usage: /pick <list>\nThis chat's lists: {names}")
+            return
+        
+        name = context.args[0].lower()
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🎲 Choose Again", callback_data=f"choose_list_{name}")]])
+        await update.message.reply_text(
+            self.render_choice(self.group_data[chat_id]['mood'], choices.title, choices.pick()),
+            reply_markup=keyboard, parse_mode='Markdown'
+        )
+
+    # INLINE MODE
+    async def inline_query_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """@bot pizza or sushi / @bot trivia / @bot roast Alex from any chat, answered without outbound calls"""
+        query = update.inline_query
+        text = " ".join(query.query.split())
+        key = text.lower()
+        # A bare "roast" roasts whoever asked, so that answer is per user
+        personal = key == 'roast'
+        if personal:
+            key = f"roast {query.from_user.id}"
+        
+        now = time.monotonic()
+        cached = self.inline_cache.get(key)
+        if cached and cached[0] > now:
+            self.inline_cache.move_to_end(key)
+            results = cached[1]
+        else:
+            results = self.inline_results(text, query.from_user)
+            self.inline_cache[key] = (now + INLINE_CACHE_SECONDS, results)
+            self.inline_cache.move_to_end(key)
+            if len(self.inline_cache) > INLINE_CACHE_SIZE:
+                self.inline_cache.popitem(last=False)
+        
+        await query.answer(results, cache_time=INLINE_CACHE_SECONDS, is_personal=personal)
+
+    def inline_results(self, text, user):
+        """Build the results for one normalized inline query from the precomputed content"""
+        command, _, rest = text.lower().partition(" ")
+        
+        if command == 'trivia':
+            trivia = self.inline_trivia
+            pool = next((results for category, results in trivia.items() if rest and category.startswith(rest)),
+                        trivia['all'])
+            return random.sample(pool, min(INLINE_MAX_RESULTS, len(pool)))
+        
+        if command == 'roast':
+            name = text[len('roast'):].strip().lstrip('@') or user.first_name
+            results = []
+            for mood, templates in self.roasts.items():
+                template = random.choice(templates)
+                roast = template.format(name=escape_markdown(name, version=1))
+                results.append(InlineQueryResultArticle(
+                    id=f"roast_{mood}", title=f"{self.moods[mood]['emoji']} {mood.title()} roast",
+                    description=template.format(name=name).replace('*', ''),
+                    input_message_content=InputTextMessageContent(f"🔥 **ROAST TIME** 🔥\n\n{roast}", parse_mode='Markdown')))
+            return results[:INLINE_MAX_RESULTS]
+        
+        options = [option for option in INLINE_CHOICE_SPLIT.split(text) if option]
+        if len(options) >= 2:
+            chosen = random.choice(options)
+            return [InlineQueryResultArticle(
+                id="choose", title=f"🎲 {' or '.join(options)}", description="Let fate decide!",
+                input_message_content=InputTextMessageContent(self.render_choice('normal', "Decision", chosen),
+                                                              parse_mode='Markdown'))]
+        
+        return self.inline_help
 
     # SPACE ADVENTURE GAME - Complete implementation
     async def space_menu_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Space Adventure main menu"""
         query = update.callback_query
         chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
         
         space_data = self.group_data[chat_id]['space_adventure']
-        current_episode = space_data.get('current_episode', 0)
-        active_game = space_data.get('active_game', False)
+        sessions = space_data['sessions']
         games_played = space_data['game_stats'].get('games_completed', 0)
         
         status_text = ""
-        if active_game:
-            episode_title = self.space_episodes[current_episode]['title']
-            status_text = f"\n🎮 **Active:** {episode_title}"
-        elif games_played > 0:
-            status_text = f"\n📊 Adventures completed: {games_played}"
+        if sessions:
+            status_text = f"\n🎮 **Crews in flight:** {len(sessions)}"
+        if games_played > 0:
+            status_text += f"\n📊 Adventures completed: {games_played}"
         
         text = f"""🚀 **Space Crew Adventure** 🚀
 
@@ -1525,20 +3441,22 @@ Can't decide? Let me choose for you!
 Join your friends as space bounty hunters in episodic adventures across the galaxy. Face challenges, make decisions, and see who survives the void!{status_text}
         """
         
-        if active_game:
-            keyboard = [
-                [InlineKeyboardButton("▶️ Continue Adventure", callback_data="space_continue")],
-                [InlineKeyboardButton("🔄 Restart Episode", callback_data="space_restart")],
-                [InlineKeyboardButton("📊 Crew Status", callback_data="space_status")],
-                [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-            ]
-        else:
-            keyboard = [
-                [InlineKeyboardButton("🆕 Start New Adventure", callback_data="space_start")],
-                [InlineKeyboardButton("📖 Episode List", callback_data="space_episodes")],
-                [InlineKeyboardButton("📊 Stats", callback_data="space_stats")],
-                [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
-            ]
+        # Your own crews first, then the most recently active ones
+        shown = sorted(sessions.values(), key=lambda s: (user_id not in s['crew_members'], -s['last_active']))
+        keyboard = []
+        for session in shown[:SPACE_MENU_SESSIONS]:
+            if session['node'] is None:
+                label = f"🙋 Crew #{session['id']} boarding ({len(session['crew_members'])})"
+            else:
+                label = f"▶️ Crew #{session['id']} · {self.space_episodes[self.space_graph[session['node']].episode]['title']}"
+            keyboard.append([InlineKeyboardButton(label, callback_data=f"space_continue_{session['id']}")])
+        
+        keyboard.extend([
+            [InlineKeyboardButton("🆕 Start New Adventure", callback_data="space_start")],
+            [InlineKeyboardButton("📖 Episode List", callback_data="space_episodes"),
+             InlineKeyboardButton("📊 Stats", callback_data="space_stats")],
+            [InlineKeyboardButton("🔙 Back", callback_data="main_menu")]
+        ])
         
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
@@ -1546,94 +3464,220 @@ Join your friends as space bounty hunters in episodic adventures across the gala
         """Handle space adventure actions"""
         query = update.callback_query
         chat_id = update.effective_chat.id
-        user = update.effective_user
         data = query.data
         
-        if data == "space_start":
-            await self.space_start_new_game(query, context)
-        elif data == "space_continue":
-            await self.space_continue_game(query, context)
-        elif data == "space_restart":
-            await self.space_restart_game(query, context)
-        elif data == "space_episodes":
-            await self.space_show_episodes(query)
-        elif data == "space_stats":
-            await self.space_show_stats(query, chat_id)
-        elif data == "space_status":
-            await self.space_show_crew_status(query, chat_id)
-        elif data.startswith("space_choice_"):
-            await self.space_handle_choice(query, context, data)
-        elif data.startswith("space_challenge_"):
-            await self.space_handle_challenge(query, context, data)
-        elif data.startswith("space_trivia_"):
-            await self.space_handle_trivia(query, context, data)
+        if data == "space_start":
+            await self.space_start_new_game(query, context)
+            return
+        elif data == "space_episodes":
+            await self.space_show_episodes(query)
+            return
+        elif data == "space_stats":
+            await self.space_show_stats(query, chat_id)
+            return
+        
+        # Everything else is space_{action}_{session id}[_{option}]; buttons left over from older
+        # versions ("space_continue", "space_challenge_complete") fall through to "adventure ended"
+        _, action, *rest = data.split("_")
+        self_answering = data.startswith(SELF_ANSWERING_CALLBACKS)
+        session = self.space_session(chat_id, int(rest[0])) if rest and rest[0].isdigit() else None
+        arg = rest[1:]
+        if action in ("choice", "trivia", "dare") and not (arg and (arg[0].isdigit() or action == "dare")):
+            session = None  # a malformed vote button is treated like a stale one
+        if session is None:
+            if action in ("choice", "trivia"):
+                await query.answer("⌛ This adventure is over!")
+            else:
+                if self_answering:
+                    await query.answer()
+                await query.edit_message_text(
+                    "🛰️ This adventure has ended. Start a new one from the space menu!",
+                    reply_markup=self.get_back_keyboard("space_menu")
+                )
+            return
+        
+        # Several crews can share a chat: anyone may board or look, only the active crew may play
+        if action in SPACE_CREW_ACTIONS and query.from_user.id not in session['crew_members'] - session['eliminated_players']:
+            await query.answer("🚫 Only this adventure's active crew can do that!", show_alert=True)
+            return
+        if self_answering and action not in ("choice", "trivia"):
+            await query.answer()
+        
+        if action == "join":
+            await self.space_join_crew(query, session)
+        elif action == "launch":
+            await self.space_launch(query, context, session)
+        elif action == "continue":
+            await self.space_show_scene(query, context, session)
+        elif action == "next":
+            await self.space_next_scene(query, context, session)
+        elif action == "restart":
+            await self.space_restart_game(query, context, session)
+        elif action == "status":
+            await self.space_show_crew_status(query, chat_id, session)
+        elif action in ("choice", "trivia"):
+            await self.space_handle_vote(query, context, session, int(arg[0]))
+        elif action == "dare":
+            await self.space_handle_challenge(query, context, session, arg[0])
+
+    def space_session(self, chat_id, session_id):
+        """Look up a live session by id and mark it active"""
+        session = self.group_data[chat_id]['space_adventure']['sessions'].get(session_id)
+        if session is not None:
+            session['last_active'] = time.time()
+        return session
+
+    def space_end_session(self, context, chat_id, session):
+        """Forget a finished or abandoned session and its pending vote timer"""
+        self.space_cancel_round(context, chat_id, session)
+        self.group_data[chat_id]['space_adventure']['sessions'].pop(session['id'], None)
+
+    async def space_collect_sessions(self, context: ContextTypes.DEFAULT_TYPE):
+        """Job queue callback: drop sessions nobody has touched for a while"""
+        cutoff = time.time() - SPACE_SESSION_IDLE_MINUTES * 60
+        collected = 0
+        for chat_id, data in self.group_data.items():
+            sessions = data['space_adventure']['sessions']
+            for session in [s for s in sessions.values() if s['last_active'] < cutoff]:
+                self.space_end_session(context, chat_id, session)
+                collected += 1
+        if collected:
+            logger.info(f"🚀 Collected {collected} idle space adventure sessions")
+
+    def space_advance(self, chat_id, session, target):
+        """Move the crew along a graph edge, counting finished episodes"""
+        current = self.space_graph[session['node']]
+        if current.type != 'choice':
+            # Heat from a choice only hangs over the scene right after it
+            session['flags'] = self.space_graph.clear_flag(session['flags'], 'heat')
+        if target == SceneGraph.END or self.space_graph[target].episode != current.episode:
+            self.group_data[chat_id]['space_adventure']['game_stats']['games_completed'] += 1
+        session['node'] = target
+
+    def space_eliminate_random(self, chat_id, session):
+        """Eliminate a random active crew member, keeping at least one alive; returns their name"""
+        active_crew = session['crew_members'] - session['eliminated_players']
+        if len(active_crew) <= 1:
+            return None
+        eliminated = random.choice(list(active_crew))
+        session['eliminated_players'].add(eliminated)
+        self.group_data[chat_id]['space_adventure']['game_stats']['total_eliminations'] += 1
+        return self.display_name(chat_id, eliminated)
+
+    def space_current_scene(self, session, *types):
+        """Current scene node if the session is underway and it is one of the expected types"""
+        node_id = session['node']
+        if node_id is None or node_id == SceneGraph.END:
+            return None
+        node = self.space_graph[node_id]
+        return node if node.type in types else None
 
     async def space_start_new_game(self, query, context):
-        """Start a new space adventure"""
+        """Open a new crew for boarding; other crews in the chat keep playing"""
         chat_id = query.message.chat_id
+        user = query.from_user
         
-        # Reset game state
         space_data = self.group_data[chat_id]['space_adventure']
-        space_data.update({
-            'current_episode': 0,
-            'current_scene': 0,
-            'crew_members': set(),
+        if not context.job_queue:
+            # No collector job running, so sweep this chat's stale sessions here
+            cutoff = time.time() - SPACE_SESSION_IDLE_MINUTES * 60
+            for stale in [s for s in space_data['sessions'].values() if s['last_active'] < cutoff]:
+                self.space_end_session(context, chat_id, stale)
+        
+        space_data['next_session'] += 1
+        session = {
+            'id': space_data['next_session'],
+            'node': None,  # scene graph node id, None while boarding
+            'flags': 0,
+            'crew_members': {user.id},
             'eliminated_players': set(),
-            'story_choices': [],
-            'active_game': True
-        })
-        
-        # Get crew members
-        members = await self.get_group_members(context, chat_id)
-        for member in members:
-            space_data['crew_members'].add(member.id)
+            'round': None,  # open crew vote: {'node', 'message_id', 'votes': {user_id: option}}
+            'last_active': time.time()
+        }
+        space_data['sessions'][session['id']] = session
+        space_data['game_stats']['sessions_started'] += 1
         
-        if len(members) < 2:
-            await query.edit_message_text(
-                "❌ Need at least 2 crew members for a space adventure!",
-                reply_markup=self.get_back_keyboard("space_menu")
-            )
+        await self.space_show_scene(query, context, session)
+
+    async def space_join_crew(self, query, session):
+        """Board a crew that hasn't launched yet"""
+        user = query.from_user
+        if session['node'] is not None:
+            await query.answer("🚀 This crew already launched!", show_alert=True)
             return
+        if user.id not in session['crew_members']:
+            session['crew_members'].add(user.id)
+        await self.space_show_boarding(query, session)
+
+    async def space_launch(self, query, context, session):
+        """Launch a boarded crew into the first episode"""
+        if session['node'] is None:
+            if len(session['crew_members']) < 2:
+                await query.edit_message_text(
+                    "❌ Need at least 2 crew members for a space adventure!",
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("🙋 Join Crew", callback_data=f"space_join_{session['id']}")],
+                        [InlineKeyboardButton("🚀 Launch", callback_data=f"space_launch_{session['id']}")],
+                        [InlineKeyboardButton("🔙 Back", callback_data="space_menu")]
+                    ])
+                )
+                return
+            session['node'] = 0
         
         # Start first episode
-        await self.space_show_scene(query, context)
+        await self.space_show_scene(query, context, session)
+
+    async def space_show_boarding(self, query, session):
+        """Show who has boarded a crew that is still forming"""
+        chat_id = query.message.chat_id
+        names = self.group_data[chat_id]['names'].names(session['crew_members'])
+        
+        text = f"🚀 **Crew #{session['id']} is boarding!** 🚀\n\n"
+        text += "Tap Join to come aboard, then launch when the crew is ready (2+ members).\n\n"
+        text += "👥 **Aboard:**\n" + "\n".join(f"   🧑‍🚀 {name}" for name in names)
+        
+        keyboard = [
+            [InlineKeyboardButton("🙋 Join Crew", callback_data=f"space_join_{session['id']}")],
+            [InlineKeyboardButton("🚀 Launch", callback_data=f"space_launch_{session['id']}")],
+            [InlineKeyboardButton("🔙 Back", callback_data="space_menu")]
+        ]
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-    async def space_continue_game(self, query, context):
-        """Continue existing adventure"""
-        await self.space_show_scene(query, context)
+    async def space_next_scene(self, query, context, session):
+        """Move past a story scene"""
+        node = self.space_current_scene(session, 'story')
+        if node:
+            self.space_advance(query.message.chat_id, session, node.edges[0])
+        await self.space_show_scene(query, context, session)
 
-    async def space_restart_game(self, query, context):
+    async def space_restart_game(self, query, context, session):
         """Restart current episode"""
         chat_id = query.message.chat_id
-        space_data = self.group_data[chat_id]['space_adventure']
         
-        space_data.update({
-            'current_scene': 0,
-            'eliminated_players': set(),
-            'story_choices': []
-        })
+        if session['node'] not in (None, SceneGraph.END):
+            self.space_cancel_round(context, chat_id, session)
+            episode_idx = self.space_graph[session['node']].episode
+            session.update({
+                'node': self.space_graph.episode_start[episode_idx],
+                'flags': 0,
+                'eliminated_players': set()
+            })
         
-        await self.space_show_scene(query, context)
+        await self.space_show_scene(query, context, session)
 
     async def space_show_episodes(self, query):
         """Show available episodes"""
-        text = "📖 **Available Episodes** 📖\n\n"
-        
-        for i, episode in enumerate(self.space_episodes):
-            status = "🎮" if i == 0 else "🔒"
-            text += f"{status} **{episode['title']}**\n"
-            text += f"   📍 {episode['planet']}\n"
-            text += f"   🎭 {episode['setting']}\n\n"
-        
         keyboard = self.get_back_keyboard("space_menu")
-        await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+        await query.edit_message_text(self.space_episode_catalog, reply_markup=keyboard, parse_mode='Markdown')
 
     async def space_show_stats(self, query, chat_id):
-        """Show space adventure statistics"""
-        stats = self.group_data[chat_id]['space_adventure']['game_stats']
+        """Show space adventure statistics, summed over every crew in the chat"""
+        space_data = self.group_data[chat_id]['space_adventure']
+        stats = space_data['game_stats']
         
         text = "📊 **Space Crew Statistics** 📊\n\n"
         text += f"🎮 **Adventures Completed:** {stats.get('games_completed', 0)}\n"
+        text += f"🚀 **Crews Launched:** {stats.get('sessions_started', 0)} ({len(space_data['sessions'])} in flight)\n"
         text += f"💀 **Total Eliminations:** {stats.get('total_eliminations', 0)}\n"
         text += f"🏆 **Successful Missions:** {stats.get('successful_missions', 0)}\n"
         text += f"🤔 **Challenges Faced:** {stats.get('challenges_completed', 0)}\n"
@@ -1645,223 +3689,308 @@ Join your friends as space bounty hunters in episodic adventures across the gala
         keyboard = self.get_back_keyboard("space_menu")
         await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
-    async def space_show_crew_status(self, query, chat_id):
+    async def space_show_crew_status(self, query, chat_id, session):
         """Show current crew status"""
-        space_data = self.group_data[chat_id]['space_adventure']
-        
-        active_crew = space_data['crew_members'] - space_data['eliminated_players']
-        eliminated = space_data['eliminated_players']
+        active_crew = session['crew_members'] - session['eliminated_players']
+        eliminated = session['eliminated_players']
         
-        text = "👥 **Current Crew Status** 👥\n\n"
+        text = f"👥 **Crew #{session['id']} Status** 👥\n\n"
         
+        directory = self.group_data[chat_id]['names']
         if active_crew:
             text += "✅ **Active Crew:**\n"
-            for user_id in active_crew:
-                name = self.group_data[chat_id]['nicknames'].get(user_id, f"User {user_id}")
-                text += f"   🚀 {name}\n"
+            text += "".join(f"   🚀 {name}\n" for name in directory.names(active_crew))
             text += "\n"
         
         if eliminated:
             text += "💀 **Eliminated:**\n"
-            for user_id in eliminated:
-                name = self.group_data[chat_id]['nicknames'].get(user_id, f"User {user_id}")
-                text += f"   ☠️ {name}\n"
+            text += "".join(f"   ☠️ {name}\n" for name in directory.names(eliminated))
         
-        keyboard = self.get_back_keyboard("space_menu")
-        await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+        keyboard = [
+            [InlineKeyboardButton("▶️ Continue Adventure", callback_data=f"space_continue_{session['id']}")],
+            [InlineKeyboardButton("🔄 Restart Episode", callback_data=f"space_restart_{session['id']}")],
+            [InlineKeyboardButton("🔙 Back", callback_data="space_menu")]
+        ]
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-    async def space_show_scene(self, query, context):
-        """Show current scene of the adventure"""
-        chat_id = query.message.chat_id
-        space_data = self.group_data[chat_id]['space_adventure']
-        
-        episode_idx = space_data['current_episode']
-        scene_idx = space_data['current_scene']
-        
-        if episode_idx >= len(self.space_episodes):
-            # Adventure complete
-            await self.space_complete_adventure(query, chat_id)
-            return
-        
-        episode = self.space_episodes[episode_idx]
-        
-        if scene_idx >= len(episode['scenes']):
-            # Episode complete, move to next
-            space_data['current_episode'] += 1
-            space_data['current_scene'] = 0
-            space_data['game_stats']['games_completed'] += 1
-            await self.space_show_scene(query, context)
-            return
-        
-        scene = episode['scenes'][scene_idx]
+    def render_space_scene(self, scene):
+        """Static parts of a scene: text around the crew number and the keyboard layout"""
+        episode = self.space_episodes[scene.episode]
+        
+        head = f"🌌 **{episode['title']}** - Scene {scene.scene + 1} · Crew #"
+        body = f"\n📍 *{episode['planet']}*\n\n{scene.text}"
+        if scene.type == 'trivia':
+            body += f"\n\n❓ {scene.question}"
+        elif scene.type == 'dare':
+            body += f"\n\n🎯 **Dare:** {scene.dare}"
+        
+        # (label, action, option suffix); the session id goes in between when stamped
+        if scene.type == 'story':
+            rows = [[("▶️ Continue", "next", "")]]
+        elif scene.type in ('choice', 'trivia'):
+            rows = [[(option, scene.type, f"_{i}")] for i, option in enumerate(scene.options)]
+        else:
+            rows = [[("✅ Done!", "dare", "_done")], [("❌ Skip", "dare", "_skip")]]
+        rows.append([("👥 Crew", "status", "")])
+        return head, body, rows
+    
+    def render_space_catalog(self):
+        """Episode list page, built once at load"""
+        text = "📖 **Available Episodes** 📖\n\n"
         
-        # Build scene text
-        text = f"🌌 **{episode['title']}** - Scene {scene_idx + 1}\n"
-        text += f"📍 *{episode['planet']}*\n\n"
-        text += scene['text']
+        for i, episode in enumerate(self.space_episodes):
+            status = "🎮" if i == 0 else "🔒"
+            text += f"{status} **{episode['title']}**\n"
+            text += f"   📍 {episode['planet']}\n"
+            text += f"   🎭 {episode['setting']}\n\n"
+        return text
+    
+    def build_space_keyboard(self, rows, sid):
+        """Stamp a session id into a scene keyboard layout"""
+        keyboard = [[InlineKeyboardButton(label, callback_data=f"space_{action}_{sid}{suffix}") for label, action, suffix in row]
+                    for row in rows]
+        keyboard[-1].append(InlineKeyboardButton("🔙 Back", callback_data="space_menu"))
+        return InlineKeyboardMarkup(keyboard)
+    
+    def space_scene_keyboard(self, node_id, sid):
+        """Cached stamped keyboard; every chat's crew #1 on the same scene shares one"""
+        key = (node_id, sid)
+        markup = self.space_keyboards.get(key)
+        if markup is None:
+            markup = self.build_space_keyboard(self.space_scene_renders[node_id][2], sid)
+            self.space_keyboards[key] = markup
+            if len(self.space_keyboards) > SPACE_KEYBOARD_CACHE:
+                self.space_keyboards.popitem(last=False)
+        else:
+            self.space_keyboards.move_to_end(key)
+        return markup
+    
+    def space_scene_view(self, chat_id, session, voting=False):
+        """Scene text and keyboard: the cached render with the crew line patched in"""
+        sid = session['id']
+        head, body, _ = self.space_scene_renders[session['node']]
+        text = f"{head}{sid}{body}"
         
         # Add crew status
-        active_crew = space_data['crew_members'] - space_data['eliminated_players']
+        active_crew = session['crew_members'] - session['eliminated_players']
         if len(active_crew) > 1:
             text += f"\n\n👥 **Active Crew:** {len(active_crew)} members"
         elif len(active_crew) == 1:
-            survivor_id = next(iter(active_crew))
-            survivor_name = self.group_data[chat_id]['nicknames'].get(survivor_id, f"User {survivor_id}")
+            survivor_name = self.display_name(chat_id, next(iter(active_crew)))
             text += f"\n\n🏆 **Sole Survivor:** {survivor_name}"
         
-        # Create appropriate buttons based on scene type
-        keyboard = []
+        if voting:
+            text += f"\n\n🗳️ **Crew vote!** {SPACE_VOTE_SECONDS}s to decide - active crew only"
+        return text, self.space_scene_keyboard(session['node'], sid)
+    
+    async def space_show_scene(self, query, context, session):
+        """Show current scene of the adventure"""
+        chat_id = query.message.chat_id
         
-        if scene['type'] == 'story':
-            keyboard.append([InlineKeyboardButton("▶️ Continue", callback_data="space_continue")])
-            
-        elif scene['type'] == 'choice':
-            for i, option in enumerate(scene['options']):
-                keyboard.append([InlineKeyboardButton(option, callback_data=f"space_choice_{i}")])
-                
-        elif scene['type'] == 'challenge':
-            if scene['challenge_type'] == 'trivia':
-                for i, option in enumerate(scene['options']):
-                    keyboard.append([InlineKeyboardButton(option, callback_data=f"space_trivia_{i}")])
-            elif scene['challenge_type'] == 'dare':
-                keyboard.append([InlineKeyboardButton("✅ Done!", callback_data="space_challenge_complete")])
-                keyboard.append([InlineKeyboardButton("❌ Skip", callback_data="space_challenge_skip")])
+        if session['node'] is None:
+            await self.space_show_boarding(query, session)
+            return
         
-        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="space_menu")])
+        if session['node'] == SceneGraph.END:
+            # Adventure complete
+            await self.space_complete_adventure(query, context, session)
+            return
         
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        # Choices and trivia are decided by a timed crew vote
+        scene = self.space_graph[session['node']]
+        voting = scene.type in ('choice', 'trivia')
+        if voting:
+            self.space_open_round(context, chat_id, session, scene, query.message.message_id)
+        
+        text, keyboard = self.space_scene_view(chat_id, session, voting and bool(context.job_queue))
+        await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+    def space_open_round(self, context, chat_id, session, scene, message_id):
+        """Start collecting crew votes for a scene, with a timer to close the round"""
+        current = session['round']
+        if current and current['node'] == scene.id:
+            # Same scene shown again - keep the votes, follow the message
+            current['message_id'] = message_id
+            return
+        
+        session['round'] = {'node': scene.id, 'message_id': message_id, 'votes': {}}
+        if context.job_queue:
+            # Kept with the round so a restart can re-arm the timer (see restore_timers)
+            session['round']['deadline'] = time.time() + SPACE_VOTE_SECONDS
+            context.job_queue.run_once(self.space_round_timeout, SPACE_VOTE_SECONDS, chat_id=chat_id,
+                                       data=(session['id'], scene.id), name=f"space_round_{chat_id}_{session['id']}")
 
-    async def space_handle_choice(self, query, context, data):
-        """Handle story choice selection"""
+    def space_cancel_round(self, context, chat_id, session):
+        """Drop the open vote and its timer"""
+        session['round'] = None
+        self.space_cancel_jobs(context, chat_id, session)
+
+    def space_cancel_jobs(self, context, chat_id, session):
+        """Remove the pending round timer, if any"""
+        if context.job_queue:
+            for job in context.job_queue.get_jobs_by_name(f"space_round_{chat_id}_{session['id']}"):
+                job.schedule_removal()
+
+    async def space_handle_vote(self, query, context, session, option_idx):
+        """Record a crew member's vote on the current choice or trivia answer"""
         chat_id = query.message.chat_id
-        choice_idx = int(data.split("_")[-1])
+        user = query.from_user
         
-        space_data = self.group_data[chat_id]['space_adventure']
-        episode = self.space_episodes[space_data['current_episode']]
-        scene = episode['scenes'][space_data['current_scene']]
+        scene = self.space_current_scene(session, 'choice', 'trivia')
+        current = session['round']
+        if not scene or not current or current['node'] != scene.id or option_idx >= len(scene.options):
+            await query.answer("⌛ This vote is already over!")
+            return
         
-        chosen_option = scene['options'][choice_idx]
-        consequence = scene['consequences'][choice_idx]
+        # space_handler has already turned away anyone outside the active crew
+        voters = session['crew_members'] - session['eliminated_players']
+        current['votes'][user.id] = option_idx
+        await query.answer(f"🗳️ Vote recorded: {scene.options[option_idx]}")
         
-        # Store choice for future reference
-        space_data['story_choices'].append({
-            'scene': space_data['current_scene'],
-            'choice': chosen_option,
-            'consequence': consequence
-        })
+        # Without timers, or once everyone has voted, settle the round right away
+        if not context.job_queue or voters.issubset(current['votes']):
+            self.space_cancel_jobs(context, chat_id, session)
+            await self.space_close_round(context.bot, chat_id, session)
+
+    async def space_round_timeout(self, context: ContextTypes.DEFAULT_TYPE):
+        """Job queue callback: the voting window is over"""
+        session_id, node_id = context.job.data
+        session = self.group_data[context.job.chat_id]['space_adventure']['sessions'].get(session_id)
+        if session and session['round'] and session['round']['node'] == node_id:
+            await self.space_close_round(context.bot, context.job.chat_id, session)
+
+    async def space_close_round(self, bot, chat_id, session):
+        """Tally the round in one go and edit the scene message once with the outcome"""
+        current, session['round'] = session['round'], None
+        scene = self.space_current_scene(session, 'choice', 'trivia')
+        if not current or not scene or current['node'] != scene.id:
+            return
         
-        # Show choice result
-        text = f"🎭 **Choice Made:** {chosen_option}\n\n"
-        
-        if consequence == 'attract_attention':
-            text += "⚠️ Your bold approach draws unwanted attention from station security!"
-        elif consequence == 'stealth_bonus':
-            text += "🥷 Smart thinking! Your stealth approach gives the crew an advantage."
-        elif consequence == 'sacrifice_needed':
-            text += "💀 Someone needs to take the risk..."
-            # Eliminate random crew member
-            active_crew = space_data['crew_members'] - space_data['eliminated_players']
-            if len(active_crew) > 1:
-                eliminated = random.choice(list(active_crew))
-                space_data['eliminated_players'].add(eliminated)
-                name = self.group_data[chat_id]['nicknames'].get(eliminated, f"User {eliminated}")
-                text += f"\n\n☠️ **{name}** volunteers and gets captured by security!"
-                space_data['game_stats']['total_eliminations'] += 1
-        
-        # Advance to next scene
-        space_data['current_scene'] += 1
-        
-        keyboard = [[InlineKeyboardButton("▶️ Continue", callback_data="space_continue")]]
+        tally = Counter(current['votes'].values())
+        if tally:
+            top = max(tally.values())
+            winner = random.choice([option for option, count in tally.items() if count == top])
+            tally_text = ", ".join(f"{scene.options[option]} ×{count}" for option, count in tally.most_common())
+            tally_text = f"\n\n🗳️ **Crew votes:** {tally_text}"
+        else:
+            winner = None
+            tally_text = "\n\n🗳️ Nobody voted!"
+        
+        if scene.type == 'choice':
+            if winner is None:
+                winner = random.randrange(len(scene.options))
+                tally_text += " Fate decides for the crew."
+            text = self.space_resolve_choice(chat_id, session, scene, winner)
+        else:
+            text = self.space_resolve_trivia(chat_id, session, scene, winner)
         
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        keyboard = [[InlineKeyboardButton("▶️ Continue", callback_data=f"space_continue_{session['id']}")]]
+        try:
+            await bot.edit_message_text(text + tally_text, chat_id=chat_id, message_id=current['message_id'],
+                                        reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        except BadRequest as e:
+            logger.warning(f"Could not post space vote result in {chat_id}: {e}")
 
-    async def space_handle_trivia(self, query, context, data):
-        """Handle trivia challenge"""
-        chat_id = query.message.chat_id
-        answer_idx = int(data.split("_")[-1])
+    def space_resolve_choice(self, chat_id, session, scene, choice_idx):
+        """Apply the crew's choice and follow its edge; returns the result text"""
+        effect = scene.effects[choice_idx]
+        # A new choice replaces any heat left from the last one
+        session['flags'] = self.space_graph.clear_flag(session['flags'], 'heat') | effect.sets
         
-        space_data = self.group_data[chat_id]['space_adventure']
-        episode = self.space_episodes[space_data['current_episode']]
-        scene = episode['scenes'][space_data['current_scene']]
+        # Show choice result
+        text = f"🎭 **Choice Made:** {scene.options[choice_idx]}\n\n"
+        text += effect.text
         
-        chosen_answer = scene['options'][answer_idx]
-        correct_answer = scene['answer']
+        if effect.eliminate:
+            name = self.space_eliminate_random(chat_id, session)
+            if name:
+                text += "\n\n" + effect.eliminate.format(name=name)
+        
+        # Follow the edge this consequence leads to
+        self.space_advance(chat_id, session, scene.edges[choice_idx])
+        return text
+
+    def space_resolve_trivia(self, chat_id, session, scene, answer_idx):
+        """Score the crew's trivia answer (None if nobody answered); returns the result text"""
+        chosen_answer = scene.options[answer_idx] if answer_idx is not None else "🤐 No answer"
+        correct_answer = scene.answer
         is_correct = chosen_answer == correct_answer
         
         text = f"🧠 **Trivia Challenge Result**\n\n"
-        text += f"❓ **Question:** {scene['question']}\n"
-        text += f"💭 **Your Answer:** {chosen_answer}\n"
+        text += f"❓ **Question:** {scene.question}\n"
+        text += f"💭 **Crew Answer:** {chosen_answer}\n"
         
-        if is_correct or correct_answer == "Any answer works!":
+        if is_correct or (answer_idx is not None and correct_answer == "Any answer works!"):
             text += "✅ **Correct!** The crew impresses the locals."
+        elif self.space_graph.has_flag(session['flags'], 'stealth'):
+            # Staying under the radar earlier buys the crew one mistake
+            session['flags'] = self.space_graph.clear_flag(session['flags'], 'stealth')
+            text += f"❌ **Wrong!** The correct answer was: {correct_answer}\n\n"
+            text += "🥷 Nobody noticed - your low profile saves the crew this time."
         else:
             text += f"❌ **Wrong!** The correct answer was: {correct_answer}\n\n"
             text += "💀 The locals get suspicious..."
             
             # Eliminate random crew member on wrong answer
-            active_crew = space_data['crew_members'] - space_data['eliminated_players']
-            if len(active_crew) > 1:
-                eliminated = random.choice(list(active_crew))
-                space_data['eliminated_players'].add(eliminated)
-                name = self.group_data[chat_id]['nicknames'].get(eliminated, f"User {eliminated}")
+            name = self.space_eliminate_random(chat_id, session)
+            if name:
                 text += f"\n☠️ **{name}** gets thrown out of the cantina!"
-                space_data['game_stats']['total_eliminations'] += 1
-        
-        space_data['game_stats']['challenges_completed'] += 1
-        space_data['current_scene'] += 1
         
-        keyboard = [[InlineKeyboardButton("▶️ Continue", callback_data="space_continue")]]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+        self.group_data[chat_id]['space_adventure']['game_stats']['challenges_completed'] += 1
+        self.space_advance(chat_id, session, scene.edges[0])
+        return text
 
-    async def space_handle_challenge(self, query, context, data):
+    async def space_handle_challenge(self, query, context, session, outcome):
         """Handle dare challenges"""
         chat_id = query.message.chat_id
         user = query.from_user
         
-        space_data = self.group_data[chat_id]['space_adventure']
+        stats = self.group_data[chat_id]['space_adventure']['game_stats']
+        scene = self.space_current_scene(session, 'dare')
+        if not scene:
+            await self.space_show_scene(query, context, session)
+            return
         
-        if data == "space_challenge_complete":
+        name = self.display_name(chat_id, user.id)
+        if outcome == "done":
             text = f"🎭 **Challenge Completed!**\n\n"
-            text += f"🌟 {user.first_name} successfully completed the dare!"
+            text += f"🌟 {name} successfully completed the dare!"
             text += "\n\nThe crew gains respect from the locals."
-        elif data == "space_challenge_skip":
+        else:
             text = f"😅 **Challenge Skipped**\n\n"
-            text += f"💀 {user.first_name} chickened out..."
+            text += f"💀 {name} chickened out..."
             
-            # Small chance of elimination for skipping
-            if random.random() < 0.3:  # 30% chance
-                active_crew = space_data['crew_members'] - space_data['eliminated_players']
+            # Small chance of elimination for skipping - certain if the crew is already drawing heat
+            if self.space_graph.has_flag(session['flags'], 'heat') or random.random() < 0.3:
+                active_crew = session['crew_members'] - session['eliminated_players']
                 if user.id in active_crew and len(active_crew) > 1:
-                    space_data['eliminated_players'].add(user.id)
-                    text += f"\n☠️ **{user.first_name}** gets kicked out for cowardice!"
-                    space_data['game_stats']['total_eliminations'] += 1
+                    session['eliminated_players'].add(user.id)
+                    text += f"\n☠️ **{name}** gets kicked out for cowardice!"
+                    stats['total_eliminations'] += 1
         
-        space_data['game_stats']['challenges_completed'] += 1
-        space_data['current_scene'] += 1
+        stats['challenges_completed'] += 1
+        self.space_advance(chat_id, session, scene.edges[0])
         
-        keyboard = [[InlineKeyboardButton("▶️ Continue", callback_data="space_continue")]]
+        keyboard = [[InlineKeyboardButton("▶️ Continue", callback_data=f"space_continue_{session['id']}")]]
         
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-    async def space_complete_adventure(self, query, chat_id):
+    async def space_complete_adventure(self, query, context, session):
         """Complete the space adventure"""
-        space_data = self.group_data[chat_id]['space_adventure']
+        chat_id = query.message.chat_id
         
-        active_crew = space_data['crew_members'] - space_data['eliminated_players']
-        eliminated = space_data['eliminated_players']
+        active_crew = session['crew_members'] - session['eliminated_players']
+        eliminated = session['eliminated_players']
         
         text = "🎊 **ADVENTURE COMPLETE!** 🎊\n\n"
         text += "🚀 The space crew has completed their mission!\n\n"
         
         if len(active_crew) > 1:
             text += f"🏆 **Survivors:** {len(active_crew)} crew members made it!\n"
-            for user_id in active_crew:
-                name = self.group_data[chat_id]['nicknames'].get(user_id, f"User {user_id}")
-                text += f"   ⭐ {name}\n"
+            text += "".join(f"   ⭐ {name}\n" for name in self.group_data[chat_id]['names'].names(active_crew))
         elif len(active_crew) == 1:
             survivor_id = next(iter(active_crew))
-            survivor_name = self.group_data[chat_id]['nicknames'].get(survivor_id, f"User {survivor_id}")
+            survivor_name = self.display_name(chat_id, survivor_id)
             text += f"🏅 **Sole Survivor:** {survivor_name}\n"
             text += "Truly the ultimate space cowboy!"
         else:
@@ -1870,19 +3999,17 @@ Join your friends as space bounty hunters in episodic adventures across the gala
         
         if eliminated:
             text += f"\n⚰️ **Fallen Heroes:** {len(eliminated)}\n"
-            for user_id in eliminated:
-                name = self.group_data[chat_id]['nicknames'].get(user_id, f"User {user_id}")
-                text += f"   ☠️ {name}\n"
+            text += "".join(f"   ☠️ {name}\n" for name in self.group_data[chat_id]['names'].names(eliminated))
         
         # Update stats
-        stats = space_data['game_stats']
+        stats = self.group_data[chat_id]['space_adventure']['game_stats']
         stats['survivor_count'] = stats.get('survivor_count', 0) + len(active_crew)
-        stats['total_players'] = stats.get('total_players', 0) + len(space_data['crew_members'])
+        stats['total_players'] = stats.get('total_players', 0) + len(session['crew_members'])
         if len(active_crew) > 0:
             stats['successful_missions'] = stats.get('successful_missions', 0) + 1
         
-        # Reset game
-        space_data['active_game'] = False
+        # The session is done; only the chat-wide stats outlive it
+        self.space_end_session(context, chat_id, session)
         
         keyboard = [
             [InlineKeyboardButton("🎮 Play Again", callback_data="space_start")],
@@ -2142,7 +4269,7 @@ Fresh memes from Russian Reddit communities!
         top_text = ""
         if sips:
             top_sipper = max(sips.items(), key=lambda x: x[1])
-            top_name = self.group_data[chat_id]['nicknames'].get(top_sipper[0], f"User {top_sipper[0]}")
+            top_name = self.display_name(chat_id, top_sipper[0])
             top_text = f"\n🍺 Champion: {top_name} ({top_sipper[1]} sips)"
         
         text = f"""🍻 **Drinking Games** 🍻
@@ -2197,14 +4324,15 @@ Fresh memes from Russian Reddit communities!
             total_sips = self.group_data[chat_id]['sip_counts'][user.id]
             
             mood = self.group_data[chat_id]['mood']
+            name = self.display_name(chat_id, user.id)
             responses = {
-                'sarcastic': f"😏 {user.first_name} admits guilt! Shocking!",
-                'pirate': f"🏴‍☠️ Arrr, {user.first_name} be takin' a swig!",
-                'pokemon': f"⚡ {user.first_name} used Drink! It's super effective!",
-                'cyberpunk': f"🌃 {user.first_name} executed drink.exe!"
+                'sarcastic': f"😏 {name} admits guilt! Shocking!",
+                'pirate': f"🏴‍☠️ Arrr, {name} be takin' a swig!",
+                'pokemon': f"⚡ {name} used Drink! It's super effective!",
+                'cyberpunk': f"🌃 {name} executed drink.exe!"
             }
             
-            response = responses.get(mood, f"🍺 {user.first_name} takes a sip!")
+            response = responses.get(mood, f"🍺 {name} takes a sip!")
             text = f"{response}\n\n📊 **Total Sips:** {total_sips}"
             
             keyboard = [
@@ -2215,7 +4343,7 @@ Fresh memes from Russian Reddit communities!
             await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
             
         elif data == "drink_innocent":
-            text = f"😇 {user.first_name} claims innocence!\n\n*Lucky this time...*"
+            text = f"😇 {self.display_name(chat_id, user.id)} claims innocence!\n\n*Lucky this time...*"
             
             keyboard = [
                 [InlineKeyboardButton("🎲 Another", callback_data="drink_never")],
@@ -2255,8 +4383,9 @@ Fresh memes from Russian Reddit communities!
             
             text = "📊 **Sip Leaderboard** 📊\n\n"
             
-            for i, (user_id, count) in enumerate(sorted_sips[:10]):
-                display_name = self.group_data[chat_id]['nicknames'].get(user_id, f"User {user_id}")
+            top = sorted_sips[:10]
+            names = self.group_data[chat_id]['names'].names(user_id for user_id, _ in top)
+            for i, ((user_id, count), display_name) in enumerate(zip(top, names)):
                 emojis = ["🍺👑", "🍻🥈", "🥃🥉", "🍷", "🍷", "🍷", "🍷", "🍷", "🍷", "🍷"]
                 emoji = emojis[i] if i < len(emojis) else "🍷"
                 
@@ -2275,7 +4404,7 @@ Fresh memes from Russian Reddit communities!
         top_text = ""
         if scores:
             top_scorer = max(scores.items(), key=lambda x: x[1])
-            top_name = self.group_data[chat_id]['nicknames'].get(top_scorer[0], f"User {top_scorer[0]}")
+            top_name = self.display_name(chat_id, top_scorer[0])
             top_text = f"\n🏆 Champion: {top_name} ({top_scorer[1]} pts)"
         
         text = f"""🧠 **Trivia Quiz** 🧠
@@ -2316,7 +4445,7 @@ Fresh memes from Russian Reddit communities!
             question = random.choice(questions)
             question_id = f"{chat_id}_{user.id}_{int(datetime.now().timestamp())}"
             
-            self.group_data[chat_id][f'active_question_{user.id}'] = {
+            self.group_data[chat_id]['active_questions'][user.id] = {
                 'question': question,
                 'question_id': question_id
             }
@@ -2335,12 +4464,11 @@ Fresh memes from Russian Reddit communities!
             question_id = "_".join(parts[2:-1])
             answer_index = int(parts[-1])
             
-            user_question_key = f'active_question_{user.id}'
-            if user_question_key not in self.group_data[chat_id]:
+            question_data = self.group_data[chat_id]['active_questions'].pop(user.id, None)
+            if question_data is None:
                 await query.edit_message_text("Question expired!", reply_markup=self.get_back_keyboard("trivia_menu"))
                 return
             
-            question_data = self.group_data[chat_id][user_question_key]
             question = question_data['question']
             
             chosen_answer = question['options'][answer_index]
@@ -2354,8 +4482,6 @@ Fresh memes from Russian Reddit communities!
                 result_text = "❌ **Incorrect!**"
                 result_text += f"\n\n🎯 **Correct Answer:** {question['answer']}"
             
-            del self.group_data[chat_id][user_question_key]
-            
             keyboard = [
                 [InlineKeyboardButton("🧠 Again", callback_data="trivia_menu")],
                 [InlineKeyboardButton("🔙 Menu", callback_data="main_menu")]
@@ -2381,6 +4507,9 @@ Current: {current_mood.title()} {self.moods[current_mood]['emoji']}
             button_text = f"{mood_data['emoji']} {mood_name.title()[:8]}{is_current}"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=f"set_mood_{mood_name}")])
         
+        rotation = "On" if self.group_data[chat_id]['mood_auto_rotate'] else "Off"
+        keyboard.append([InlineKeyboardButton(f"🔄 Daily Rotation: {rotation}", callback_data="toggle_auto_rotate")])
+        keyboard.append([InlineKeyboardButton("🎧 Passive Listening", callback_data="passive_menu")])
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="main_menu")])
         
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
@@ -2391,18 +4520,76 @@ Current: {current_mood.title()} {self.moods[current_mood]['emoji']}
         chat_id = update.effective_chat.id
         data = query.data
         
-        if data.startswith("set_mood_"):
+        if data == "toggle_auto_rotate":
+            enabled = not self.group_data[chat_id]['mood_auto_rotate']
+            if context.job_queue:
+                self.set_scheduled(chat_id, 'mood', enabled)
+            else:
+                self.group_data[chat_id]['mood_auto_rotate'] = enabled
+            if enabled:
+                await self.maybe_auto_rotate_mood(chat_id)
+            await self.mood_menu_handler(update, context)
+        
+        elif data.startswith("set_mood_"):
             mood = data.split("_")[-1]
             
             if mood in self.moods:
+                # A hand-picked mood sticks: stop the daily rotation from overwriting it
+                rotating = self.group_data[chat_id]['mood_auto_rotate']
+                self.set_scheduled(chat_id, 'mood', False)
                 self.group_data[chat_id]['mood'] = mood
                 emoji = self.moods[mood]['emoji']
+                note = "\n🔄 Daily rotation turned off." if rotating else ""
                 
                 await query.edit_message_text(
-                    f"{emoji} Mood set to {mood.title()}!",
+                    f"{emoji} Mood set to {mood.title()}!{note}",
                     reply_markup=self.get_back_keyboard("mood_menu")
                 )
 
+    async def passive_menu_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Passive listening settings"""
+        query = update.callback_query
+        chat_id = update.effective_chat.id
+        group = self.group_data[chat_id]
+        policy = group['passive_policy']
+        
+        enabled = group['passive_triggers_enabled']
+        status = "✅ On" if enabled else "❌ Off"
+        
+        text = f"""🎧 **Passive Listening** 🎧
+
+Status: {status}
+Sensitivity: {policy.sensitivity.title()}
+Chat speed: {policy.messages_per_minute():.0f} msgs/min
+Current cooldown: {policy.cooldown():.0f}s
+        """
+        
+        keyboard = [
+            [InlineKeyboardButton("🔇 Turn Off" if enabled else "🔊 Turn On", callback_data="passive_toggle")]
+        ]
+        for level in PASSIVE_SENSITIVITY:
+            is_current = " ✓" if level == policy.sensitivity else ""
+            keyboard.append([InlineKeyboardButton(f"{level.title()}{is_current}", callback_data=f"passive_sensitivity_{level}")])
+        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="mood_menu")])
+        
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+    async def passive_settings_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Toggle passive listening or change its sensitivity"""
+        query = update.callback_query
+        chat_id = update.effective_chat.id
+        data = query.data
+        group = self.group_data[chat_id]
+        
+        if data == "passive_toggle":
+            group['passive_triggers_enabled'] = not group['passive_triggers_enabled']
+        elif data.startswith("passive_sensitivity_"):
+            level = data.split("_")[-1]
+            if level in PASSIVE_SENSITIVITY:
+                group['passive_policy'].sensitivity = level
+        
+        await self.passive_menu_handler(update, context)
+
     # SIMPLE GAME HANDLERS
     async def coin_flip_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Coin flip handler"""
@@ -2449,24 +4636,31 @@ More games coming soon!
         
         if karma_stats:
             top_payer = max(karma_stats.items(), key=lambda x: x[1])
-            payer_name = self.group_data[chat_id]['nicknames'].get(top_payer[0], f"User {top_payer[0]}")
+            payer_name = self.display_name(chat_id, top_payer[0])
             text += f"💸 **Most Generous:** {payer_name} ({top_payer[1]} times)\n"
         
+        paid_totals = self.group_data[chat_id]['payment_fairness'].totals
+        big_spender = max(paid_totals.items(), key=lambda x: x[1][1], default=None)
+        if big_spender and big_spender[1][1] > 0:
+            spender_name = self.display_name(chat_id, big_spender[0])
+            text += f"🧾 **Biggest Spender:** {spender_name} ({big_spender[1][1]:.2f} paid)\n"
+        
         if sip_stats:
             top_sipper = max(sip_stats.items(), key=lambda x: x[1])
-            sipper_name = self.group_data[chat_id]['nicknames'].get(top_sipper[0], f"User {top_sipper[0]}")
+            sipper_name = self.display_name(chat_id, top_sipper[0])
             text += f"🍺 **Drinking Champion:** {sipper_name} ({top_sipper[1]} sips)\n"
         
         if trivia_stats:
             top_brain = max(trivia_stats.items(), key=lambda x: x[1])
-            brain_name = self.group_data[chat_id]['nicknames'].get(top_brain[0], f"User {top_brain[0]}")
+            brain_name = self.display_name(chat_id, top_brain[0])
             text += f"🧠 **Trivia Master:** {brain_name} ({top_brain[1]} points)\n"
         
         if space_stats.get('games_completed', 0) > 0:
             text += f"🚀 **Space Adventures:** {space_stats['games_completed']} completed\n"
         
-        active_members = len(self.group_data[chat_id]['active_members'])
-        text += f"\n👥 **Active Members:** {active_members}"
+        members_index = self.group_data[chat_id]['active_members']
+        present = len(members_index.recent(ACTIVE_MEMBER_HOURS))
+        text += f"\n👥 **Active Members:** {present} now ({len(members_index)} seen)"
         
         keyboard = self.get_back_keyboard("main_menu")
         await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
@@ -2490,34 +4684,569 @@ More games coming soon!
         chat_id = update.effective_chat.id
         text = update.message.text.strip()
         
-        if update.effective_user:
-            self.group_data[chat_id]['active_members'].add(update.effective_user.id)
+        self.group_data[chat_id]['active_members'].touch(update.effective_user)
         
         # First check for passive triggers
         if await self.check_passive_triggers(update, context):
-            return  # Passive trigger handled, stop processing
+            return  # Passive trigger handled (or deferred to the batcher, which may answer it), stop processing
         
-        # Easter Eggs
+        # Easter Eggs - one pass over the message for every egg
         text_lower = text.lower()
-        easter_eggs = {
-            'konami': "🕹️ **KONAMI CODE ACTIVATED!** 🕹️\nExtra karma for everyone!",
-            'ninja': "🥷 **NINJA MODE UNLOCKED!** 🥷\nStealth payments activated!",
-            'legendary': "🌟 **LEGENDARY STATUS!** 🌟\nYou're now a decision master!",
-            'up up down down': "🎮 **CHEAT CODE ACCEPTED!** 🎮\nInfinite lives granted!",
-            'sakura': "🌸 **SAKURA POWER!** 🌸\nCherry blossom energy activated!"
-        }
-        
-        for trigger, message in easter_eggs.items():
-            if trigger in text_lower:
-                self.group_data[chat_id]['discovered_easter_eggs'].add(trigger)
-                await update.message.reply_text(message, reply_markup=self.get_main_menu_keyboard(chat_id), parse_mode='Markdown')
-                return
+        found = [match.group() for match in self.easter_egg_pattern.finditer(text_lower)]
+        if found:
+            self.group_data[chat_id]['discovered_easter_eggs'].update(found)
+            await update.message.reply_text(self.easter_eggs[found[0]], reply_markup=self.get_main_menu_keyboard(chat_id), parse_mode='Markdown')
+            return
         
         # Show main menu for direct commands
         if text_lower in ['menu', 'start', 'help', '/start', '/help']:
             await self.start(update, context)
 
 
+# UPDATE INGESTION
+# Raw updates waiting for a worker; beyond this they spill to disk (or Telegram is asked to retry)
+INBOX_SIZE = int(os.getenv('INBOX_SIZE', '1000'))
+INBOX_SPILL_PATH = os.getenv('INBOX_SPILL_PATH', 'inbox_spill.jsonl')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+
+# How far past the committed offset update_ids are tracked; anything further is refused until the window slides
+UPDATE_WINDOW = 10000
+# On a fresh start, ids this far below the first update are still taken: a webhook backlog arrives out of order
+UPDATE_ANCHOR_SLACK = 100
+# How long a missing update_id may hold the offset back (webhooks can arrive out of order) before it is skipped
+UPDATE_GAP_SECONDS = float(os.getenv('UPDATE_GAP_SECONDS', '60'))
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', 'crew_checkpoint.bin')
+CHECKPOINT_SECONDS = 5
+# Checkpoints wait for a moment with no handler mid-update; past this age one pauses the workers to get it,
+# but gives up if the running handlers take longer than the pause allows
+CHECKPOINT_MAX_AGE = 60
+CHECKPOINT_PAUSE_SECONDS = 2
+
+# Checkpoint file layout; bump the schema when the saved chat state changes shape
+SNAPSHOT_MAGIC = b'CREW'
+SNAPSHOT_SCHEMA = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHBBBI')  # magic, schema, marshal version, Python major.minor, CRC32 of the body
+
+# On SIGTERM, how long queued and in-flight updates get to finish before state is saved anyway
+SHUTDOWN_SECONDS = float(os.getenv('SHUTDOWN_SECONDS', '8'))
+
+# Long-poll timeout, and the pause before re-asking when a batch held nothing new
+POLL_TIMEOUT = 30
+POLL_RETRY_SECONDS = 0.25
+
+
+class UpdateWindow:
+    """Processed update_ids as a committed offset plus a bitmap over the ids just above it"""
+
+    def __init__(self, committed=None, done=0, size=UPDATE_WINDOW):
+        # Every update_id up to here is fully processed; None until the first update on a fresh deployment
+        self.committed = committed
+        self.size = size
+        self.claimed = done  # bit i: update committed + 1 + i has been accepted
+        self.done = done     # bit i: ... and its handlers have finished
+        self.gap_since = None  # when the update right after committed went missing while later ones arrived
+        self._slide()
+
+    def anchor(self, update_id):
+        """With no saved offset, start the window a little below the first update seen (real ids are ~1e9)"""
+        if self.committed is None:
+            # Ids in the slack that never arrive are settled by the next poll or skipped once the gap expires
+            self.committed = max(update_id - 1 - UPDATE_ANCHOR_SLACK, 0)
+
+    def rebase(self, update_id):
+        """After a week without updates Telegram picks the next id at random; follow it while nothing is pending"""
+        if self.committed is None or self.claimed or abs(update_id - self.committed) <= self.size:
+            return False
+        self.committed = None
+        self.anchor(update_id)
+        return True
+
+    def known(self, update_id):
+        # Far below the offset is not a redelivery but a restart of the ids, see rebase()
+        if update_id <= self.committed:
+            return self.committed - update_id <= self.size
+        return bool(self.claimed >> (update_id - self.committed - 1) & 1)
+
+    def fits(self, update_id):
+        return abs(update_id - self.committed) <= self.size
+
+    def claim(self, update_id):
+        if update_id <= self.committed:
+            return
+        self.claimed |= 1 << (update_id - self.committed - 1)
+        self._slide()
+
+    def finish(self, update_id):
+        """Mark an update processed and slide the committed offset over the finished prefix"""
+        if update_id <= self.committed:
+            return
+        self.done |= 1 << (update_id - self.committed - 1)
+        self._slide()
+
+    def settle(self, update_id):
+        """Polling: Telegram returns updates in order, so unclaimed ids up to this one were never sent"""
+        if self.committed is None or update_id <= self.committed:
+            return
+        missing = ((1 << (update_id - self.committed)) - 1) & ~self.claimed
+        self.claimed |= missing
+        self.done |= missing
+        self._slide()
+
+    def expire_gap(self, now=None):
+        """Give up on a missing update once the gap in front of the window is UPDATE_GAP_SECONDS old"""
+        now = time.monotonic() if now is None else now
+        if self.gap_since is None or now - self.gap_since < UPDATE_GAP_SECONDS:
+            return False
+        missing = (self.claimed & -self.claimed) - 1
+        self.claimed |= missing
+        self.done |= missing
+        self._slide()
+        return True
+
+    def _slide(self):
+        # Only over ids that really finished; one that has not arrived yet may still be on its way
+        step = (~self.done & (self.done + 1)).bit_length() - 1
+        if step > 0:
+            self.committed += step
+            self.claimed >>= step
+            self.done >>= step
+        if self.claimed & 1 or not self.claimed:
+            self.gap_since = None
+        elif self.gap_since is None:
+            self.gap_since = time.monotonic()
+
+
+def encode_snapshot(payload):
+    """marshal and zlib the payload behind a header: magic, schema, marshal and Python versions, CRC32"""
+    body = zlib.compress(marshal.dumps(payload), 1)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA, marshal.version, *sys.version_info[:2],
+                                zlib.crc32(body)) + body
+
+
+def decode_snapshot(blob):
+    if len(blob) < SNAPSHOT_HEADER.size:
+        raise ValueError("truncated snapshot")
+    magic, schema, marshal_version, major, minor, crc = SNAPSHOT_HEADER.unpack_from(blob)
+    body = memoryview(blob)[SNAPSHOT_HEADER.size:]
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a CrewCaptain snapshot")
+    if schema != SNAPSHOT_SCHEMA:
+        raise ValueError(f"snapshot schema {schema}, expected {SNAPSHOT_SCHEMA}")
+    if marshal_version > marshal.version:
+        raise ValueError(f"snapshot written by Python {major}.{minor} with a newer marshal format")
+    if zlib.crc32(body) != crc:
+        raise ValueError("snapshot checksum mismatch")
+    return marshal.loads(zlib.decompress(body))
+
+
+class UpdateCheckpoint:
+    """Committed offset and the chat state it reflects, written together so a crash leaves the old pair or the new"""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.saved = None
+        self.saved_at = time.monotonic()
+
+    def load(self, bot_id):
+        try:
+            with open(self.path, 'rb') as f:
+                data = decode_snapshot(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            logger.warning(f"⚠️ Ignoring checkpoint {self.path}: {e}")
+            return None
+        # Offsets belong to one bot; a new token starts from scratch
+        if data.get('bot_id') != bot_id:
+            return None
+        self.saved = (data['offset'], data['done'], 0)
+        return data
+
+    def write(self, bot_id, window, captain):
+        data = {'bot_id': bot_id, 'offset': window.committed, 'done': window.done, 'chats': captain.snapshot_chats(),
+                'schedule': captain.schedule.to_state()}
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(encode_snapshot(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def save(self, bot_id, window, captain, force=False):
+        """Write the checkpoint right here, e.g. on shutdown once the loop has nothing left to do"""
+        # Timers fire without any update arriving, so their changes count as progress too
+        position = (window.committed, window.done, captain.schedule.revision)
+        if not self.path or (position == self.saved and not force):
+            return
+        self.write(bot_id, window, captain)
+        self.saved = position
+        self.saved_at = time.monotonic()
+
+    async def save_in_background(self, bot_id, window, captain, inbox=None):
+        """Write the checkpoint from a forked child working on a copy-on-write view of memory"""
+        position = (window.committed, window.done, captain.schedule.revision)
+        if not self.path or position == self.saved:
+            return
+        # A handler halfway through an update would be saved half-applied, then applied again on redelivery
+        if inbox and inbox.in_flight and time.monotonic() - self.saved_at < CHECKPOINT_MAX_AGE:
+            return
+        
+        async with (inbox.paused(CHECKPOINT_PAUSE_SECONDS) if inbox else nullcontext(True)) as quiet:
+            if not quiet:
+                logger.warning(f"⚠️ Checkpoint skipped: {inbox.in_flight} updates still running after the pause")
+                return
+            position = (window.committed, window.done, captain.schedule.revision)
+            if not hasattr(os, 'fork'):
+                self.save(bot_id, window, captain)
+                return
+            # Only the fork needs the pause; the child keeps the frozen state while the workers carry on
+            pid = os.fork()
+        if pid == 0:
+            # Child: state is frozen at the fork, so offset and chats match while the parent carries on
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            gc.disable()  # a collection would touch, and so copy, every page of the parent's heap
+            try:
+                self.write(bot_id, window, captain)
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        
+        try:
+            while True:
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    break
+                await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            # Let the child finish first, or it could replace a newer checkpoint written on shutdown
+            os.waitpid(pid, 0)
+            raise
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.saved = position
+            self.saved_at = time.monotonic()
+        else:
+            logger.warning(f"⚠️ Background checkpoint failed with status {status}")
+
+
+class ChatLanes:
+    """One lock per chat, so each chat's updates run one at a time and in order while other chats run alongside"""
+
+    def __init__(self):
+        self.locks = {}
+        self.holders = Counter()  # workers holding or waiting on each lock; at zero the lock is dropped
+
+    @staticmethod
+    def key(update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        return update.effective_user.id if update.effective_user else None
+
+    @asynccontextmanager
+    async def hold(self, update):
+        key = self.key(update)
+        if key is None:
+            yield
+            return
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.holders[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.holders[key] -= 1
+            if not self.holders[key]:
+                del self.holders[key], self.locks[key]
+
+
+class UpdateInbox:
+    """Bounded FIFO of raw updates with on-disk overflow and exactly-once admission"""
+
+    def __init__(self, window, maxsize=INBOX_SIZE, spill_path=INBOX_SPILL_PATH):
+        self.queue = asyncio.Queue(maxsize)
+        self.spill_path = spill_path
+        self.window = window
+        self.accepting = True
+        self.stats = Counter()
+        self.lanes = ChatLanes()
+        # Handlers mid-update, and the gates a checkpoint uses to catch a moment with none
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.open = asyncio.Event()
+        self.open.set()
+        # Updates left on disk by a previous run are still owed processing
+        self.spilled = 0
+        if spill_path and os.path.exists(spill_path):
+            with open(spill_path, encoding='utf-8') as f:
+                spilled_ids = [json.loads(line)['update_id'] for line in f if line.strip()]
+            if spilled_ids:
+                window.anchor(min(spilled_ids))
+            for update_id in spilled_ids:
+                window.claim(update_id)
+            self.spilled = len(spilled_ids)
+
+    def offer(self, raw):
+        """Accept an update without blocking: 'queued', 'spilled', 'duplicate' or 'full'"""
+        update_id = raw['update_id']
+        if not self.accepting:
+            return 'full'
+        previous = self.window.committed
+        if self.window.rebase(update_id):
+            logger.warning(f"⚠️ update_id jumped from {previous} to {update_id}; restarting the window there")
+        self.window.anchor(update_id)
+        if self.window.known(update_id):
+            self.stats['duplicate'] += 1
+            return 'duplicate'
+        if not self.window.fits(update_id):
+            self.stats['full'] += 1
+            return 'full'
+        
+        # Once anything is on disk, new updates queue behind it to keep delivery order
+        if not self.spilled and not self.queue.full():
+            self.queue.put_nowait(raw)
+            outcome = 'queued'
+        elif self.spill_path:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(raw) + "\n")
+            self.spilled += 1
+            outcome = 'spilled'
+        else:
+            self.stats['full'] += 1
+            return 'full'
+        
+        self.window.claim(update_id)
+        self.stats[outcome] += 1
+        return outcome
+
+    def refill(self):
+        """Move spilled updates back into the queue while there is room"""
+        room = self.queue.maxsize - self.queue.qsize()
+        # While shutting down, spilled updates stay on disk for the next run
+        if not self.spilled or not self.accepting or room < self.queue.maxsize // 2:
+            return
+        with open(self.spill_path, encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+        for line in lines[:room]:
+            self.queue.put_nowait(json.loads(line))
+        rest = lines[room:]
+        with open(self.spill_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(rest)
+        os.replace(self.spill_path + '.tmp', self.spill_path)
+        self.spilled = len(rest)
+
+    async def get(self):
+        self.refill()
+        return await self.queue.get()
+
+    @asynccontextmanager
+    async def running(self):
+        """Count a handler in flight, first waiting out any checkpoint pause"""
+        await self.open.wait()
+        self.in_flight += 1
+        self.idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self.idle.set()
+
+    @asynccontextmanager
+    async def paused(self, timeout):
+        """Hold back new updates until none is running; yields False if that takes longer than the timeout"""
+        self.open.clear()
+        try:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout)
+                quiet = True
+            except asyncio.TimeoutError:
+                quiet = False
+            yield quiet
+        finally:
+            self.open.set()
+
+
+async def inbox_worker(application, inbox):
+    """Drain the inbox through the normal PTB handler chain, one update at a time per chat"""
+    while True:
+        raw = await inbox.get()
+        started = False
+        try:
+            # Taken straight from the queue with no await in between, so a chat's updates queue on its lock in order
+            update = Update.de_json(raw, application.bot)
+            async with inbox.lanes.hold(update), inbox.running():
+                started = True
+                await application.process_update(update)
+        except Exception:
+            logger.exception(f"❌ Update {raw['update_id']} failed")
+        except asyncio.CancelledError:
+            # Cut off by the shutdown deadline. Not started yet: left uncommitted and redelivered after restart.
+            # Started: some of its changes are in memory, and replaying it on top of them would apply it twice
+            if started:
+                inbox.window.finish(raw['update_id'])
+            inbox.queue.task_done()
+            raise
+        # A failed update counts as processed too; retrying it forever would stall the offset
+        inbox.window.finish(raw['update_id'])
+        inbox.queue.task_done()
+
+
+async def poll_updates(application, inbox):
+    """Long-poll from the committed offset, so Telegram keeps everything not yet processed"""
+    while True:
+        try:
+            # No offset yet on a fresh deployment: Telegram starts from its oldest unconfirmed update
+            committed = inbox.window.committed
+            updates = await application.bot.get_updates(
+                offset=None if committed is None else committed + 1,
+                timeout=POLL_TIMEOUT, read_timeout=POLL_TIMEOUT + 10,
+                allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            logger.warning(f"⚠️ get_updates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        
+        fresh = 0
+        for update in updates:
+            outcome = inbox.offer(update.to_dict())
+            if outcome == 'full':
+                break
+            fresh += outcome != 'duplicate'
+            inbox.window.settle(update.update_id)
+        
+        # Everything returned is still in flight; give the workers a moment instead of spinning
+        if updates and not fresh:
+            await asyncio.sleep(POLL_RETRY_SECONDS)
+
+
+async def checkpoint_updates(checkpoint, bot_id, inbox, captain):
+    while True:
+        await asyncio.sleep(CHECKPOINT_SECONDS)
+        if inbox.window.expire_gap():
+            logger.warning(f"⚠️ Skipped update_ids that never arrived; resuming after update {inbox.window.committed}")
+        await checkpoint.save_in_background(bot_id, inbox.window, captain, inbox)
+
+
+async def drain(inbox, captain, deadline):
+    """Let queued and in-flight updates and passive batches finish, up to the deadline"""
+    try:
+        await asyncio.wait_for(inbox.queue.join(), max(deadline - time.monotonic(), 0))
+        if captain.passive_batcher:
+            await asyncio.wait_for(captain.passive_batcher.drain(), max(deadline - time.monotonic(), 0))
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def serve(application, captain, webhook_url=None, port=None, url_path="/webhook"):
+    """Run the bot behind the inbox, fed by our own webhook server or by long polling, until SIGTERM"""
+    # Derived from the token rather than random, so during a rolling deploy the old and new instance both accept
+    # whatever Telegram sends, whichever of them set the webhook last
+    secret = os.getenv('WEBHOOK_SECRET') or hmac.new(application.bot.token.encode(), b'crew-webhook',
+                                                     hashlib.sha256).hexdigest()
+    
+    # The bot id is the token prefix, so the checkpoint loads before any network call
+    started = time.perf_counter()
+    bot_id = int(application.bot.token.split(':')[0])
+    checkpoint = UpdateCheckpoint()
+    # Loading creates millions of containers; without this the cyclic GC runs over them again and again
+    gc.disable()
+    try:
+        saved = checkpoint.load(bot_id)
+        if saved:
+            captain.restore_chats(saved['chats'])
+            captain.schedule = ChatSchedule(saved.get('schedule', ()))
+    finally:
+        gc.enable()
+    # Long-lived state: keep it out of future collections and out of the pages a forked checkpoint copies
+    gc.freeze()
+    # Checkpoints written before any update arrived carry no usable offset
+    window = UpdateWindow(saved['offset'] or None, saved['done']) if saved else UpdateWindow()
+    inbox = UpdateInbox(window)
+    runner = None
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C still raises KeyboardInterrupt
+    
+    if webhook_url:
+        async def receive(request):
+            """Validate, enqueue and answer straight away; handlers run later in the workers"""
+            if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+                return web.Response(status=403)
+            try:
+                raw = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(raw, dict) or not isinstance(raw.get('update_id'), int):
+                return web.Response(status=400)
+            
+            # Non-2xx makes Telegram redeliver later, which is what we want when there is truly no room
+            return web.Response(status=503 if inbox.offer(raw) == 'full' else 200)
+        
+        # Bind the port first so the platform health check passes while the bot starts
+        app = web.Application()
+        app.router.add_post(url_path, receive)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    if webhook_url:
+        await application.bot.set_webhook(webhook_url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    else:
+        await application.bot.delete_webhook()
+    await application.start()
+    timers = captain.restore_timers(application.job_queue)
+    if saved:
+        logger.info(f"♻️ Restored {len(saved['chats'])} chats, {timers} vote timers and "
+                    f"{len(captain.schedule.due)} scheduled events "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+    
+    workers = [asyncio.create_task(inbox_worker(application, inbox)) for _ in range(WEBHOOK_WORKERS)]
+    feeds = [asyncio.create_task(checkpoint_updates(checkpoint, bot_id, inbox, captain))]
+    if not webhook_url:
+        feeds.append(asyncio.create_task(poll_updates(application, inbox)))
+    logger.info(f"🚀 CrewCaptain running with {'webhook: ' + webhook_url if webhook_url else 'polling'} "
+                f"({WEBHOOK_WORKERS} workers, "
+                f"{'fresh start' if window.committed is None else f'resuming after update {window.committed}'})")
+    
+    try:
+        await stop.wait()
+        logger.info("🛑 Shutting down...")
+    finally:
+        # Stop intake first; Telegram keeps or redelivers anything not yet acknowledged
+        started = time.monotonic()
+        inbox.accepting = False
+        for task in feeds:
+            task.cancel()
+        if runner:
+            await runner.cleanup()
+        
+        drained = await drain(inbox, captain, started + SHUTDOWN_SECONDS)
+        for task in workers:
+            task.cancel()
+        # Let the cancelled workers commit what they had started before the state is written
+        await asyncio.gather(*workers, return_exceptions=True)
+        if not drained:
+            unfinished = (window.claimed & ~window.done).bit_count()
+            logger.warning(f"⚠️ Shutdown deadline hit; {unfinished} updates not yet started "
+                           f"will be redelivered after restart")
+        
+        checkpoint.save(bot_id, window, captain, force=True)
+        await application.stop()
+        await application.shutdown()
+        logger.info(f"💾 State saved after update {window.committed}, "
+                    f"shutdown took {(time.monotonic() - started) * 1000:.0f} ms")
+
+
 def main():
     """Main function with Railway deployment support"""
     # Get configuration from environment variables (Railway compatible)
@@ -2534,36 +5263,49 @@ def main():
     bot = CrewCaptain()
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(bot.post_init).build()
     
     # Add handlers
+    application.add_handler(TypeHandler(Update, bot.record_names), group=-1)
     application.add_handler(CommandHandler(["start", "help", "menu"], bot.start))
+    application.add_handler(CommandHandler("whopays", bot.who_pays_command))
+    application.add_handler(CommandHandler("spent", bot.spent_command))
+    application.add_handler(CommandHandler(["balance", "settle"], bot.balance_command))
+    application.add_handler(CommandHandler("list", bot.list_command))
+    application.add_handler(CommandHandler("pick", bot.pick_command))
+    application.add_handler(CommandHandler("choose", bot.choose_command))
+    application.add_handler(CommandHandler("poll", bot.poll_command))
+    application.add_handler(CommandHandler("schedule", bot.schedule_command))
     application.add_handler(CallbackQueryHandler(bot.handle_callback))
+    application.add_handler(InlineQueryHandler(bot.inline_query_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+    application.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, bot.handle_member_left))
+    
+    # Periodic sweep of idle space adventure sessions, and the tick that fires per-chat scheduled events
+    if application.job_queue:
+        application.job_queue.run_repeating(bot.space_collect_sessions, interval=SPACE_SESSION_SWEEP_SECONDS,
+                                            first=SPACE_SESSION_SWEEP_SECONDS)
+        application.job_queue.run_repeating(bot.run_schedule, interval=SCHEDULE_TICK_SECONDS,
+                                            first=SCHEDULE_TICK_SECONDS)
     
     # Railway deployment support
     if RAILWAY_STATIC_URL:
         # Running on Railway with webhook
         webhook_url = f"{RAILWAY_STATIC_URL}/webhook"
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path="/webhook",
-            webhook_url=webhook_url
-        )
-        logger.info(f"🚀 CrewCaptain running on Railway with webhook: {webhook_url}")
+        asyncio.run(serve(application, bot, webhook_url, PORT))
     else:
         # Local development with polling
         logger.info("🚀 CrewCaptain running locally with polling...")
-        logger.info("🎧 PASSIVE LISTENING: ✅ Enabled (10s cooldown)")
+        logger.info("🎧 PASSIVE LISTENING: ✅ Enabled (adaptive cooldown, per-chat sensitivity)")
         logger.info("🎵 YouTube API: " + ("✅ Enabled" if YOUTUBE_API_KEY else "❌ Disabled (using fallback)"))
         logger.info("😂 Russian Memes: ✅ Enabled (Reddit API)")
         logger.info("🧠 Trivia Questions: ✅ 150+ Questions")
         logger.info("🍻 Drinking Games: ✅ 100+ Never Have I Ever")
         logger.info("🎭 Personalities: ✅ 10 Different Moods")
-        logger.info("🚀 Space Adventure: ✅ Complete Story Mode")
+        logger.info("🚀 Space Adventure: ✅ Complete Story Mode" + (
+            f" ({SPACE_VOTE_SECONDS}s crew votes)" if application.job_queue else " (no job queue - first vote decides)"))
         
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        asyncio.run(serve(application, bot))
 
 
 if __name__ == '__main__':
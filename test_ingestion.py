@@ -0,0 +1,137 @@
+import asyncio
+
+from decision_bot import UPDATE_ANCHOR_SLACK, UPDATE_GAP_SECONDS, UpdateInbox, UpdateWindow, inbox_worker
+
+
+def test_cold_start_accepts_real_update_ids():
+    """No checkpoint: the window anchors on the first update instead of refusing everything above 10000"""
+    inbox = UpdateInbox(UpdateWindow(), spill_path=None)
+    assert inbox.offer({'update_id': 702345678}) == 'queued'
+    assert inbox.window.committed == 702345677 - UPDATE_ANCHOR_SLACK
+    assert inbox.offer({'update_id': 702345678}) == 'duplicate'
+    assert inbox.offer({'update_id': 702345679}) == 'queued'
+
+    inbox.window.finish(702345678)
+    inbox.window.finish(702345679)
+    assert inbox.window.expire_gap(inbox.window.gap_since + UPDATE_GAP_SECONDS + 1)
+    assert inbox.window.committed == 702345679
+
+
+def test_cold_start_takes_a_backlog_out_of_order():
+    """The first webhook delivery need not be the lowest id of the backlog"""
+    inbox = UpdateInbox(UpdateWindow(), spill_path=None)
+    assert [inbox.offer({'update_id': i}) for i in (702345105, 702345104, 702345106)] == ['queued'] * 3
+    for update_id in (702345104, 702345105, 702345106):
+        inbox.window.finish(update_id)
+    inbox.window.settle(702345106)
+    assert inbox.window.committed == 702345106
+
+
+def test_window_follows_a_random_restart_of_update_ids():
+    """After a quiet week Telegram may continue far above or below the committed offset"""
+    for jump in (20000, -999500):
+        inbox = UpdateInbox(UpdateWindow(1000000), spill_path=None)
+        update_id = 1000000 + jump
+        assert [inbox.offer({'update_id': update_id + i}) for i in range(3)] == ['queued'] * 3
+        for i in range(3):
+            inbox.window.finish(update_id + i)
+        inbox.window.settle(update_id + 2)
+        assert inbox.window.committed == update_id + 2
+
+
+def test_window_does_not_rebase_while_updates_are_pending():
+    """Out-of-range ids are refused, so Telegram retries them, until the pending update has finished"""
+    inbox = UpdateInbox(UpdateWindow(1000000), spill_path=None)
+    assert inbox.offer({'update_id': 1000001}) == 'queued'
+    assert inbox.offer({'update_id': 1020000}) == 'full'
+    assert inbox.offer({'update_id': 500}) == 'full'
+    assert inbox.offer({'update_id': 999999}) == 'duplicate'
+
+    inbox.window.finish(1000001)
+    assert inbox.offer({'update_id': 500}) == 'queued'
+
+
+def test_gap_holds_the_offset_until_it_expires():
+    """An update that has not arrived yet is not committed over, until the gap times out"""
+    window = UpdateWindow(100)
+    window.claim(102)
+    window.finish(102)
+    assert window.committed == 100
+    assert not window.expire_gap(window.gap_since + UPDATE_GAP_SECONDS - 1)
+
+    window.claim(101)
+    window.finish(101)
+    assert window.committed == 102 and window.gap_since is None
+
+    window.claim(104)
+    window.finish(104)
+    assert window.expire_gap(window.gap_since + UPDATE_GAP_SECONDS + 1)
+    assert window.committed == 104
+
+
+def test_polling_settles_ids_telegram_skipped():
+    window = UpdateWindow(100)
+    window.claim(103)
+    window.settle(103)
+    assert window.committed == 102
+    window.finish(103)
+    assert window.committed == 103
+
+
+def test_workers_keep_each_chat_in_order():
+    """Concurrent workers never run two updates of one chat at once, and run them in arrival order"""
+    class FakeApplication:
+        bot = None
+
+        def __init__(self):
+            self.running, self.seen, self.overlaps = set(), [], 0
+
+        async def process_update(self, update):
+            chat_id = update.effective_chat.id
+            self.overlaps += chat_id in self.running
+            self.running.add(chat_id)
+            await asyncio.sleep(0.001 * (-update.update_id % 5))
+            self.seen.append((chat_id, update.update_id))
+            self.running.discard(chat_id)
+
+    async def run():
+        application, inbox = FakeApplication(), UpdateInbox(UpdateWindow(), spill_path=None)
+        for update_id in range(1, 31):
+            inbox.offer({'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': 0, 'text': 'hi',
+                'chat': {'id': update_id % 3, 'type': 'group'}}})
+        workers = [asyncio.create_task(inbox_worker(application, inbox)) for _ in range(8)]
+        await inbox.queue.join()
+        for worker in workers:
+            worker.cancel()
+        return application, inbox
+
+    application, inbox = asyncio.run(run())
+    seen = application.seen
+    assert not application.overlaps
+    for chat_id in range(3):
+        assert [u for c, u in seen if c == chat_id] == list(range(chat_id or 3, 31, 3))
+    assert inbox.window.committed == 30 and not inbox.lanes.locks
+
+
+def test_checkpoint_pause_waits_for_running_updates():
+    """A pause only yields once no handler is mid-update, and holds new ones back until it ends"""
+    async def run():
+        inbox, log = UpdateInbox(UpdateWindow(), spill_path=None), []
+
+        async def handler(name, delay):
+            async with inbox.running():
+                log.append(f"{name} start")
+                await asyncio.sleep(delay)
+                log.append(f"{name} end")
+
+        first = asyncio.create_task(handler('first', 0.02))
+        await asyncio.sleep(0)
+        async with inbox.paused(1) as quiet:
+            second = asyncio.create_task(handler('second', 0))
+            await asyncio.sleep(0.01)
+            log.append(f"paused {quiet}")
+        await asyncio.gather(first, second)
+        return log
+
+    assert asyncio.run(run()) == ['first start', 'first end', 'paused True', 'second start', 'second end']